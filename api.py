@@ -1,20 +1,39 @@
+import os
+import json
 import flask
 from flask import request
 from datetime import datetime
-import pandas as pd
+from dateutil.relativedelta import relativedelta
+from prometheus_client import CONTENT_TYPE_LATEST
 
 # importation of linked python file
-import scraping
 import process
 import model
+import registry
+import pipeline
+import jobs
+import cache
+import metrics
+import review_store
 
 import warnings
 warnings.filterwarnings(action='ignore')
 
-# instantiate Flask
-app = flask.Flask(__name__)
-app.config["DEBUG"] = False
+# routes of the api, registered on the application by create_app
+bp = flask.Blueprint('api', __name__)
 
+# models loaded before /healthz reports the api as ready
+READY_MODELS = [name for name in os.environ.get('READY_MODELS', 'spacy,word2vec,bigram').split(',') if name]
+# '1' to load READY_MODELS in background when the application is created
+WARM_UP = os.environ.get('WARM_UP', '0') not in ('', '0', 'false')
+
+# results of /graphs per parameters, fresh for RESULT_CACHE_TTL seconds then served as stale
+# while refreshed in background for RESULT_CACHE_STALE seconds
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 600))
+RESULT_CACHE_STALE = float(os.environ.get('RESULT_CACHE_STALE', 3600))
+# results are read from SQLite on every request, so that every gunicorn worker serves the same results
+result_cache = cache.Cache('results', memory_size=0, max_age=RESULT_CACHE_TTL + RESULT_CACHE_STALE,
+                           max_entries=int(os.environ.get('RESULT_CACHE_SIZE', 128)))
 
 def dict_factory(cursor, row):
     d = {}
@@ -23,7 +42,7 @@ def dict_factory(cursor, row):
     return d
 
 
-@app.route('/', methods=['GET'])
+@bp.route('/', methods=['GET'])
 def home():
     return '''<h1>Bienvenue sur l'API d'analyse de sentiments</h1>
 <p>Pour effectuer une recherche, ajoutez '/graphs?category=' suivi de la catégorie visée à la barre de recherche</p>
@@ -33,8 +52,15 @@ def home():
         <li> le nombre de page à rechercher pour chaque site '&num_page=' (0 pour toutes les pages, défaut = 2)</li>
         <li> la ville dans laquelle effectuer la recherche  '&location=' (nom de ville ou numéro de département)</li>
         <li> utiliser camemBERT pour la modélisation '&model=camembert' (plus long mais meilleur résultat)</li>
+        <li> utiliser camemBERT exporté avec onnxruntime '&model=camembert_onnx', ou quantifié en int8 '&model=camembert_int8' (plus rapide sur CPU)</li>
+        <li> des résumés sur d'autres périodes que les 3 derniers mois '&windows=7d,30d,365d' (en jours, ou en mois: '6m')</li>
+        <li> ne récupérer que les nouveaux avis depuis la dernière recherche '&incremental=1' (les avis déjà récupérés sont réutilisés)</li>
     </ul>
 </p>
+<p>Dans le résumé, 'nb_concurent' est le nombre de sites trouvés sur les pages de la catégorie lues: les pages ne sont plus lues une fois 'num_of_site' sites trouvés, c'est donc le nombre de sites de la catégorie seulement avec '&num_of_site=0'. 'nb_concurrent_analysed' est le nombre de sites analysés</p>
+<p>Pour recevoir les résultats de chaque site dès qu'ils sont prêts, remplacez '/graphs' par '/graphs/stream' (un objet json par ligne)</p>
+<p>Pour refaire l'analyse des avis déjà récupérés sans nouvelle recherche, remplacez '/graphs' par '/test' (ajoutez '&months=' pour ne garder que les derniers mois)</p>
+<p>Pour les analyses longues, envoyez les mêmes paramètres en POST sur '/jobs', puis suivez l'avancement sur '/jobs/' suivi de l'identifiant renvoyé</p>
 <p>Exemple:  
     <a href="http://127.0.0.1:5000/graphs?category=restaurants_bars&num_of_site=3&num_page=3">http://127.0.0.1:5000/graphs?category=restaurants_bars&num_of_site=3&num_page=3</a>
 </p>
@@ -67,125 +93,171 @@ def home():
 '''
 
 
-@app.route('/graphs', methods=['GET'])
+@bp.route('/graphs', methods=['GET'])
 def graphs():
-    initial_time = datetime.now()
     # 1. Get infos for scraping
-    # Mandatory argument : Category
-    category = request.args.get('category')
+    params = pipeline.get_params(request.args)
+    key = jobs.params_key(params)
 
-    # Optional argument
-    # number of site to scrape per category, default 5 (0 for max)
-    if request.args.get('num_of_site'):
-        num_of_site = int(request.args.get('num_of_site'))
-    else:
-        num_of_site = 5
-    # number of page to scrape per site, default 2 (0 for max)
-    if request.args.get('num_page'):
-        num_page = int(request.args.get('num_page'))
-    else:
-        num_page = 2
-    # city where the scraping is desired (better with department number)
-    if request.args.get('location'):
-        location = request.args.get('location')
-    else:
-        location = 'no city'
-    # model to use for scraping (one option 'camembert', else default model)
-    model_to_test = ''
-    if request.args.get('model'):
-        model_to_test = 'camembert'
+    # '&profile=cprofile' or '&profile=pyinstrument' runs a new analysis under a profiler
+    if request.args.get('profile'):
+        json_review, profile = metrics.profile(pipeline.analyse, params, backend=request.args.get('profile'))
+        if isinstance(json_review, dict):
+            json_review = dict(json_review, profile=profile)
+        return json_review
 
-    print('\n', '#'*50)
-    print(f' Start Analyse on {category} '.center(50, '#'))
-    print('#'*50, '\n')
+    # results of identical analyses are served from cache, 'Cache-Control: no-cache' forces a new analysis
+    json_review, age = None, None
+    if 'no-cache' not in request.headers.get('Cache-Control', ''):
+        json_review, age = result_cache.get_with_age(key)
 
-    # 2. Scrape trustpilot to get dataframe
-    init_time = datetime.now()
-    print(' Start scraping '.center(30, '#'))
-    refs, df = scraping.scrape(category, location, num_of_site, num_page)
-    time_elapsed = datetime.now() - init_time
-    print(f'Scraping time : {time_elapsed}')
-    if len(df)>0:
-        # 3. Preprocess dataframe before prediction
-        init_time = datetime.now()
-        print(' Start preprocess '.center(30, '#'))
-        df = process.preprocess_df(df)
-        time_elapsed = datetime.now() - init_time
-        print(f'Preprocess time : {time_elapsed}')
-
-        # 4. Predict sentiment and add it to dataframe
-        init_time = datetime.now()
-        print(' Start prediction '.center(30, '#'))
-        if model_to_test == 'camembert':
-            df = model.predict_camembert(df)
-        else:
-            df = model.predict(df)
-        time_elapsed = datetime.now() - init_time
-        print(f'Prediction time : {time_elapsed}')
-
-        # 5. Apply postprocess to transform data into json
-        init_time = datetime.now()
-        print(' Start postprocess '.center(30, '#'))
-        json_review = process.postprocess(df, refs)
-        time_elapsed = datetime.now() - init_time
-        print(f'Postprocess time : {time_elapsed}')
+    if json_review is None:
+        # 2-5. scrape, preprocess, predict and postprocess
+        json_review = pipeline.analyse(params)
+        result_cache.set(key, json_review)
+        status = 'MISS'
+    elif age < RESULT_CACHE_TTL:
+        status = 'HIT'
     else:
-        print("No data found")
-        json_review = "<h1>Pas de données</h1>"
-    time_elapsed = datetime.now() - initial_time
-    print(f'Total time elapsed : {time_elapsed}')
-    return json_review
+        # serve the stale result while the analysis runs again in background,
+        # a refresh already running in any worker is reused
+        try:
+            jobs.submit(params, callback=lambda result: result_cache.set(key, result))
+        except jobs.QueueFull as error:
+            print(f'Stale result not refreshed : {error}')
+        status = 'STALE'
+
+    response = flask.make_response(json_review)
+    response.headers['X-Cache'] = status
+    response.headers['Age'] = str(int(age or 0))
+    return response
+
+
+@bp.route('/graphs/stream', methods=['GET'])
+def graphs_stream():
+    # same parameters as /graphs, details of each site are sent as soon as they are ready,
+    # one json object per line, then summary and last 3 months
+    params = pipeline.get_params(request.args)
+    records = (json.dumps(record, ensure_ascii=False) + '\n' for record in pipeline.analyse_stream(params))
+    return flask.Response(flask.stream_with_context(records), mimetype='application/x-ndjson')
+
+
+@bp.route('/jobs', methods=['POST'])
+def create_job():
+    # run an analysis in background, same parameters as /graphs in query, form or json body
+    args = request.get_json(silent=True) or request.values
+    params = pipeline.get_params(args)
+    key = jobs.params_key(params)
+    try:
+        job_id = jobs.submit(params, callback=lambda result: result_cache.set(key, result))
+    except jobs.QueueFull:
+        response = flask.make_response("<h1>503</h1><p>Too many analyses are running, try again later.</p>", 503)
+        response.headers['Retry-After'] = '60'
+        return response
+    response = flask.jsonify(jobs.get(job_id))
+    response.status_code = 202
+    response.headers['Location'] = flask.url_for('.get_job', job_id=job_id)
+    return response
+
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # status, progress per stage and result of an analysis
+    job = jobs.get(job_id)
+    if job is None:
+        return "<h1>404</h1><p>The job could not be found.</p>", 404
+    return job
 
 
-@app.route('/test', methods=['GET'])
+@bp.route('/test', methods=['GET'])
 def test():
+    # postprocess reviews of the review store again, without scraping nor prediction
+    # same category and model parameters as /graphs, '&months=' to keep only the last months
     initial_time = datetime.now()
-    category = 'restaurants_bars'
-
-    model_to_test = ''
-    if request.args.get('model'):
-        model_to_test = 'camembert'
+    params = pipeline.get_params(request.args)
+    category = params['category'] or 'restaurants_bars'
+    # the category is a folder name of the review store
+    if not review_store.CATEGORY_PATTERN.fullmatch(category):
+        return "<h1>Catégorie invalide</h1>", 400
+    since = None
+    if request.args.get('months'):
+        since = datetime.now() - relativedelta(months=int(request.args.get('months')))
 
     print('\n', '#'*50)
-    print(f' Start Analyse on {category} '.center(50, '#'))
+    print(f' Start Analyse on {category} from review store '.center(50, '#'))
     print('#'*50, '\n')
 
-    init_time = datetime.now()
-    print(' Start scraping '.center(30, '#'))
-    time_elapsed = datetime.now() - init_time
-    print(f'Scraping time : {time_elapsed}')
-
-    init_time = datetime.now()
-    print(' Start preprocess '.center(30, '#'))
-    time_elapsed = datetime.now() - init_time
-    print(f'Preprocess time : {time_elapsed}')
-
-    # 4. Predict sentiment and add it to dataframe
-    init_time = datetime.now()
-    print(' Start prediction '.center(30, '#'))
-    if model_to_test == 'camembert':
-        df = pd.read_csv(f'predict_{category}_cam.csv')
-    else:
-        df = pd.read_csv(f'predict_{category}.csv')
-    refs = [df.site.unique(), df.site.unique()]
-    time_elapsed = datetime.now() - init_time
-    print(f'Prediction time : {time_elapsed}')
+    with metrics.stage('store'):
+        df = review_store.load(category, model_to_test=params['model'], since=since)
+    if len(df) == 0:
+        print("No data found")
+        return "<h1>Pas de données</h1>"
+    refs = [list(df.site.unique()), list(df.site.unique())]
 
     # 5. Apply postprocess to transform data into json
-    init_time = datetime.now()
-    print(' Start postprocess '.center(30, '#'))
-    json_review = process.postprocess(df, refs)
-    time_elapsed = datetime.now() - init_time
-    print(f'Postprocess time : {time_elapsed}')
-    time_elapsed = datetime.now() - initial_time
-    print(f'Total time elapsed : {time_elapsed}')
-
+    with metrics.stage('postprocess'):
+        json_review = process.postprocess(df, refs, params['windows'])
+    print(f'Total time elapsed : {datetime.now() - initial_time}')
     return json_review
 
 
-@app.errorhandler(404)
+@bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # stage durations, pages fetched, cache hits and batch sizes in Prometheus format
+    return flask.Response(metrics.export(), mimetype=CONTENT_TYPE_LATEST)
+
+
+@bp.route('/healthz', methods=['GET'])
+def healthz():
+    # ready once the models needed by default analyses are loaded, 503 before
+    loaded = {name: registry.is_loaded(name) for name in READY_MODELS}
+    ready = all(loaded.values())
+    return flask.jsonify(status='ready' if ready else 'loading', models=loaded), 200 if ready else 503
+
+
+@bp.route('/models', methods=['GET'])
+def models():
+    # loading time and memory of every model
+    return registry.stats()
+
+
+@bp.route('/memory', methods=['GET'])
+def memory():
+    # memory of the worker answering the request
+    return registry.memory_usage()
+
+
+@bp.route('/models/reload', methods=['POST'])
+def reload_model():
+    # swap a model with the weight files currently on disk, without restarting the api
+    name = request.args.get('name')
+    if name not in registry.stats():
+        return f"<h1>Modèle inconnu : {name}</h1>", 404
+    registry.reload(name)
+    return registry.stats()[name]
+
+
+@bp.app_errorhandler(404)
 def page_not_found(e):
     return "<h1>404</h1><p>The resource could not be found.</p>", 404
 
 
-app.run()
+def create_app() -> flask.Flask:
+    """
+    instantiate Flask with the routes of the api
+    models are loaded on first use, in background with WARM_UP=1, or before with registry.preload (see wsgi.py)
+    :return: Flask: application
+    """
+    app = flask.Flask(__name__)
+    app.config["DEBUG"] = False
+    app.register_blueprint(bp)
+    if WARM_UP:
+        registry.warm_up(READY_MODELS)
+    return app
+
+
+if __name__ == '__main__':
+    # serve at once and load default models in background, /healthz tells when they are loaded,
+    # camembert is loaded on first use
+    registry.warm_up(READY_MODELS)
+    create_app().run()
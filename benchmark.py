@@ -0,0 +1,527 @@
+import os
+import sys
+import glob
+import json
+import time
+import threading
+import numpy as np
+
+import cache
+import model
+import parsers
+import process
+import registry
+import stub_server
+
+# short french reviews combined to build benchmark datasets
+SENTENCES = [
+    "Très bon service, livraison rapide et produit conforme à la description.",
+    "Commande jamais reçue, le service client ne répond pas aux mails !",
+    "Je recommande ce site, les prix sont corrects et le suivi est parfait.",
+    "Produit arrivé cassé, remboursement refusé. Une honte...",
+    "Personnel accueillant, repas délicieux 😀 nous reviendrons avec plaisir.",
+    "Délai de livraison trop long mais le vendeur a été à l'écoute.",
+    "Arnaque totale, fuyez ce site 😡",
+    "Qualité au rendez-vous, emballage soigné, merci à toute l'équipe.",
+]
+
+
+def make_texts(size: int, seed: int = 0) -> list:
+    """
+    build random reviews made of 1 to 4 french sentences
+    """
+    rng = np.random.default_rng(seed)
+    return [' '.join(SENTENCES[i] for i in rng.integers(0, len(SENTENCES), rng.integers(1, 5)))
+            for _ in range(size)]
+
+
+# ####################################
+# ############ BENCHMARKS ############
+# ####################################
+
+
+def timed(function, *args, **kwargs) -> tuple:
+    """
+    run a function and measure its duration
+    :return: tuple: result of the function, duration in seconds
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def loop_average_vector(reviews: list, index2word: list, embeddings: np.array) -> np.array:
+    """
+    previous averaging of word vectors: vocabulary set rebuilt and one np.add per word for every review
+    """
+    num_features = embeddings.shape[1]
+    review_feature_vecs = np.zeros((len(reviews), num_features), dtype="float32")
+    word_ids = {word: i for i, word in enumerate(index2word)}
+    for counter, review in enumerate(reviews):
+        feature_vec = np.zeros(num_features, dtype="float32")
+        nb_words = 0
+        index2word_set = set(index2word)
+        for word in review:
+            if word in index2word_set:
+                nb_words += 1
+                feature_vec = np.add(feature_vec, embeddings[word_ids[word]])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            review_feature_vecs[counter] = np.divide(feature_vec, nb_words)
+    return np.nan_to_num(review_feature_vecs)
+
+
+def bench_average_vector(sizes=(1000, 10000, 100000), vocab_size=30000, num_features=100):
+    """
+    compare previous loop and vectorized averaging of word vectors on random reviews
+    """
+    rng = np.random.default_rng(0)
+    index2word = [f'mot{i}' for i in range(vocab_size)]
+    embeddings = rng.standard_normal((vocab_size, num_features)).astype("float32")
+    vocab = {word: i for i, word in enumerate(index2word)}
+    # 20% of the words are out of the vocabulary
+    words = index2word + [f'inconnu{i}' for i in range(vocab_size // 4)]
+
+    print(' Word2Vec averaging '.center(50, '#'))
+    for size in sizes:
+        reviews = [[words[i] for i in rng.integers(0, len(words), rng.integers(0, 60))] for _ in range(size)]
+        vectorized, vectorized_time = timed(model.get_average_vector_model, reviews, vocab, embeddings)
+        loop, loop_time = timed(loop_average_vector, reviews, index2word, embeddings)
+        assert np.allclose(loop, vectorized, atol=1e-5)
+        print(f'{size:>7} reviews : loop {loop_time:8.3f}s | vectorized {vectorized_time:8.3f}s '
+              f'| x{loop_time / vectorized_time:.0f}')
+
+
+def bench_preprocess(sizes=(100, 1000), n_process=1):
+    """
+    compare per review preprocess and bulk preprocessing with nlp.pipe, both outputs must be identical
+    """
+    print(' Preprocess '.center(50, '#'))
+    for size in sizes:
+        texts = make_texts(size)
+        per_row, per_row_time = timed(lambda: [process.preprocess(txt) for txt in texts])
+        bulk, bulk_time = timed(process.preprocess_bulk, texts, n_process=n_process)
+        assert per_row == bulk
+        print(f'{size:>7} reviews : per review {per_row_time:8.3f}s | nlp.pipe {bulk_time:8.3f}s '
+              f'| x{per_row_time / bulk_time:.1f}')
+
+
+def bench_parse(repeat=50):
+    """
+    compare parser backends on saved review pages, every backend must give the records of html.parser
+    """
+    pages = []
+    for path in sorted(glob.glob(os.path.join(stub_server.FIXTURES_DIR, 'review', '*', '*.html'))):
+        with open(path, 'rb') as file:
+            pages.append((os.path.basename(os.path.dirname(path)), file.read()))
+
+    print(' HTML parsing '.center(50, '#'))
+    reference = [parsers.parse_review_page(content, site, 'html.parser') for site, content in pages]
+    for backend in parsers.BACKENDS:
+        try:
+            parsed, parse_time = timed(lambda: [[parsers.parse_review_page(content, site, backend)
+                                                 for site, content in pages] for _ in range(repeat)])
+        except ImportError:
+            print(f'{backend:>12} : not installed')
+            continue
+        assert parsed[0] == reference
+        print(f'{backend:>12} : {len(pages) * repeat / parse_time:8.1f} pages/s')
+
+
+def make_reviews_df(size: int, nb_sites: int = 20, seed: int = 0):
+    """
+    build a dataframe of preprocessed random reviews with random sites and sentiments
+    """
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    tokens = [process.preprocess(sentence) for sentence in SENTENCES]
+    reviews = [sum((tokens[i] for i in rng.integers(0, len(tokens), rng.integers(1, 5))), [])
+               for _ in range(size)]
+    return pd.DataFrame({
+        'site': [f'site{i}.fr' for i in rng.integers(0, nb_sites, size)],
+        'date': [f'2021-{month:02d}-15T12:00:00.000Z' for month in rng.integers(1, 13, size)],
+        'review': reviews,
+        'sentiment': rng.integers(0, 2, size)
+    })
+
+
+def legacy_word_cloud(df, nb_of_words=30) -> dict:
+    """
+    previous word cloud: vectorizer and tfidf fitted on the slice, words counted from the concatenated lists
+    """
+    import pandas as pd
+    from collections import Counter
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+    word_cloud = {}
+    if len(df) == 0:
+        return word_cloud
+    df = df.dropna(subset=['review'], axis="rows")
+    cvec = CountVectorizer(stop_words=process.get_stop_words(), min_df=1, max_df=1.0, ngram_range=(1, 2))
+    try:
+        sf = cvec.fit_transform(df['review'].map(process.clean_txt).to_list())
+    except ValueError:
+        # no word left once stop words are removed
+        return word_cloud
+    transformed_weights = TfidfTransformer().fit_transform(sf)
+    weights = np.asarray(transformed_weights.mean(axis=0)).ravel().tolist()
+    weights_df = pd.DataFrame({'term': cvec.get_feature_names(), 'weight': weights})
+    tfidf = weights_df.sort_values(by='weight', ascending=False).head(nb_of_words)
+    count_pos = Counter([process.clean_txt(word) for word in df['review'].sum(axis=0)])
+    for _, row in tfidf.iterrows():
+        if count_pos[row.term] > 0:
+            word_cloud[row.term] = {'tfidf': row.weight, 'nb_occurrence': count_pos[row.term]}
+    return word_cloud
+
+
+def legacy_details(df) -> dict:
+    """
+    previous get_details: filters of the full dataframe and word clouds fitted for every site and sentiment
+    """
+    detail = {}
+    for site in df['site'].unique():
+        df_pos = df[(df['site'] == site) & (df['sentiment'] == 1)]
+        df_neg = df[(df['site'] == site) & (df['sentiment'] == 0)]
+        detail[site] = {
+            'nb_review_analysed': len(df[df['site'] == site]),
+            'nb_review': {'pos': len(df_pos), 'neg': len(df_neg)},
+            'word_cloud': {'pos': legacy_word_cloud(df_pos), 'neg': legacy_word_cloud(df_neg)}
+        }
+    return detail
+
+
+def same_word_clouds(expected: dict, result: dict) -> bool:
+    # same terms and numbers of occurrence, tfidf weights equal up to float rounding
+    return expected.keys() == result.keys() and all(
+        expected[term]['nb_occurrence'] == result[term]['nb_occurrence']
+        and np.isclose(expected[term]['tfidf'], result[term]['tfidf']) for term in expected)
+
+
+def bench_word_cloud(sizes=(1000, 10000)):
+    """
+    compare word clouds of every site from the previous per slice vectorizer and from the shared engine,
+    both must be identical
+    """
+    print(' Word clouds '.center(50, '#'))
+    for size in sizes:
+        df = make_reviews_df(size)
+        legacy, legacy_time = timed(legacy_details, df)
+        engine, fit_time = timed(process.WordCloudEngine, df)
+        shared, shared_time = timed(process.get_details, df, engine)
+        assert legacy.keys() == shared.keys()
+        for site in legacy:
+            assert legacy[site]['nb_review_analysed'] == shared[site]['nb_review_analysed']
+            assert legacy[site]['nb_review'] == shared[site]['nb_review']
+            assert all(same_word_clouds(legacy[site]['word_cloud'][sentiment], shared[site]['word_cloud'][sentiment])
+                       for sentiment in ('pos', 'neg'))
+        print(f'{size:>7} reviews : per slice {legacy_time:8.3f}s | shared fit {fit_time + shared_time:8.3f}s')
+
+
+def bench_count_words(sizes=(10000, 100000)):
+    """
+    compare word counting by concatenation of lists with the counts of word clouds of WordCloudEngine,
+    numbers of occurrence must be identical
+    """
+    from collections import Counter
+    print(' Word counting '.center(50, '#'))
+    for size in sizes:
+        df = make_reviews_df(size)
+        df_pos = df[df['sentiment'] == 1]
+        # previous counting: pairwise concatenation of lists then clean_txt on every word
+        concatenated, concatenated_time = timed(lambda: Counter([process.clean_txt(word)
+                                                                 for word in df_pos['review'].sum(axis=0)]))
+        engine, fit_time = timed(process.WordCloudEngine, df)
+        word_cloud, word_cloud_time = timed(engine.word_cloud, df_pos)
+        assert all(concatenated[term] == word['nb_occurrence'] for term, word in word_cloud.items())
+        print(f'{size:>7} reviews : concatenation {concatenated_time:8.3f}s | '
+              f'engine fit {fit_time:8.3f}s, word cloud {word_cloud_time:8.3f}s')
+
+
+def bench_windows(sizes=(10000, 100000), windows=('7d', '30d', '90d', '365d')):
+    """
+    compare summaries of time windows with dates parsed at every window and with one sorted time index,
+    both summaries must be identical
+    """
+    import pandas as pd
+    from datetime import datetime, timedelta
+    print(' Time windows '.center(50, '#'))
+    now = datetime.now()
+    for size in sizes:
+        df = make_reviews_df(size)
+        days = np.random.default_rng(0).integers(0, 730, size)
+        df['date'] = [(now - timedelta(days=int(day))).strftime('%Y-%m-%dT%H:%M:%S.000Z') for day in days]
+        engine = process.WordCloudEngine(df)
+
+        def parse_every_window():
+            # previous get_last_month: dates of a copy of the frame parsed for every window
+            summaries = {}
+            for window in windows:
+                window_df = df.copy()
+                window_df['date'] = pd.to_datetime(window_df['date'].str[:19], format='%Y-%m-%dT%H:%M:%S')
+                summaries[window] = process.get_summary(window_df[window_df['date'] >= process.window_start(window)],
+                                                        engine=engine)
+            return summaries
+
+        def sorted_index():
+            time_index = process.TimeIndex(df)
+            return {window: process.get_window(df, window, engine, time_index) for window in windows}
+
+        parsed, parsed_time = timed(parse_every_window)
+        indexed, indexed_time = timed(sorted_index)
+        assert parsed == indexed
+        print(f'{size:>7} reviews : parse per window {parsed_time:8.3f}s | sorted index {indexed_time:8.3f}s')
+
+
+def bench_camembert(sizes=(64, 512), batch_sizes=(1, 16)):
+    """
+    compare latency and throughput of camemBERT backends on cpu, onnx backends need export_camembert.py
+    predictions of every backend are compared with the torch model
+    """
+    print(' CamemBERT backends '.center(50, '#'))
+    for size in sizes:
+        comments = make_texts(size)
+        for size_of_batch in batch_sizes:
+            reference = None
+            for backend in model.CAMEMBERT_BACKENDS:
+                try:
+                    registry.get(backend)
+                except (ImportError, OSError) as error:
+                    print(f'{backend:>15} : not available ({error.__class__.__name__})')
+                    continue
+                logits, duration = timed(model.camembert_logits, comments, size_of_batch, backend)
+                predictions = np.argmax(logits, axis=1)
+                if reference is None:
+                    reference = predictions
+                print(f'{size:>5} reviews, batch {size_of_batch:>3} | {backend:>15} : '
+                      f'{size / duration:8.1f} reviews/s | {duration / size * size_of_batch * 1000:8.1f} ms/batch '
+                      f'| same prediction {np.mean(predictions == reference):.1%}')
+
+
+# modules that must not be imported by 'import api', they are imported when a model or stage needs them
+HEAVY_MODULES = ['tensorflow', 'keras', 'torch', 'transformers', 'gensim', 'spacy', 'nltk', 'sklearn', 'onnxruntime',
+                 'pyarrow']
+
+
+def bench_import_time(module='api', top=10, repeat=3):
+    """
+    measure import time of the api with python -X importtime in new processes,
+    and check that heavy backends are not imported at start
+    """
+    import subprocess
+    print(' Import time '.center(50, '#'))
+    totals = []
+    for _ in range(repeat):
+        imported = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                                   f'import sys, json, {module}; print(json.dumps(sorted(sys.modules)))'],
+                                  capture_output=True, text=True, check=True)
+        # lines of stderr: 'import time: self [us] | cumulative | imported package'
+        times = {}
+        for line in imported.stderr.splitlines():
+            parts = [part.strip() for part in line.split('|')]
+            if line.startswith('import time:') and parts[1].isdigit():
+                times[parts[2]] = int(parts[1])
+        totals.append(times[module] / 1e6)
+
+    print(f'import {module} : {min(totals):.2f}s (best of {repeat})')
+    for name, cumulative in sorted(times.items(), key=lambda item: -item[1])[1:top + 1]:
+        print(f'{name.strip():>40} : {cumulative / 1e6:.2f}s')
+
+    modules = json.loads(imported.stdout.splitlines()[-1])
+    heavy = [name for name in HEAVY_MODULES if name in modules]
+    assert not heavy, f'{", ".join(heavy)} imported by import {module}'
+    return min(totals)
+
+
+# ####################################
+# ########### END TO END #############
+# ####################################
+
+# folder of the stand-in models used by the end to end benchmark
+STAND_IN_DIR = os.path.join(cache.CACHE_DIR, 'stand_in_models')
+
+
+def fixture_comments() -> list:
+    """
+    get 'titre comment' of every review of the recorded pages
+    """
+    comments = []
+    for path in sorted(glob.glob(os.path.join(stub_server.FIXTURES_DIR, 'review', '*', '*.html'))):
+        with open(path, 'rb') as file:
+            infos, _ = parsers.parse_review_page(file.read(), os.path.basename(os.path.dirname(path)))
+        comments.extend(' '.join(info[2:4]) for info in infos if len(info) == 5)
+    return comments
+
+
+def make_stand_in_models(directory: str = STAND_IN_DIR, num_features: int = 100, seed: int = 0) -> str:
+    """
+    build small models with the files and formats of the real ones, learnt on recorded reviews,
+    so that the pipeline runs without downloading weights (predictions are meaningless)
+    use them with SENTIMENT_MODEL_DIR=<directory> and CAMEMBERT_BASE=<directory>/camembert-base
+    :param directory: str: folder of the models
+    :param num_features: int: size of word vectors
+    :param seed: int: seed of random weights
+    :return: str: folder of the models
+    """
+    import torch
+    import sentencepiece
+    from gensim.models import Word2Vec
+    from transformers import CamembertConfig, CamembertTokenizer, CamembertForSequenceClassification
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    comments = fixture_comments() + SENTENCES
+
+    # 1. Word2Vec learnt on preprocessed reviews
+    word2vec = Word2Vec(process.preprocess_bulk(comments), size=num_features, min_count=1, seed=seed, workers=1)
+    word2vec.save(os.path.join(directory, os.path.basename(model.WORD2VEC_FILE)))
+
+    # 2. dense model with random weights, in the format of convert_bigram.py
+    shapes = [(num_features, 16), (16, 1)]
+    np.savez(os.path.join(directory, os.path.basename(model.BIGRAM_NPZ_FILE)),
+             activations=np.array(['relu', 'sigmoid']),
+             **{f'kernel_{i}': rng.standard_normal(shape).astype("float32") * 0.1 for i, shape in enumerate(shapes)},
+             **{f'bias_{i}': np.zeros(shape[1], dtype="float32") for i, shape in enumerate(shapes)})
+
+    # 3. tiny camemBERT with a sentencepiece tokenizer learnt on reviews
+    base_dir = os.path.join(directory, 'camembert-base')
+    os.makedirs(base_dir, exist_ok=True)
+    corpus = os.path.join(directory, 'comments.txt')
+    with open(corpus, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(comments))
+    sentencepiece.SentencePieceTrainer.train(input=corpus, model_prefix=os.path.join(directory, 'sentencepiece'),
+                                             vocab_size=200, hard_vocab_limit=False)
+    tokenizer = CamembertTokenizer(os.path.join(directory, 'sentencepiece.model'))
+    tokenizer.save_pretrained(base_dir)
+
+    torch.manual_seed(seed)
+    config = CamembertConfig(vocab_size=len(tokenizer), hidden_size=32, num_hidden_layers=2,
+                             num_attention_heads=2, intermediate_size=64,
+                             max_position_embeddings=model.MAX_LEN + 2, num_labels=2)
+    camembert = CamembertForSequenceClassification(config)
+    camembert.save_pretrained(base_dir)
+    torch.save(camembert.state_dict(), os.path.join(directory, os.path.basename(model.CAMEMBERT_FILE)))
+    return directory
+
+
+class PeakMemory:
+    """
+    sample resident memory in a background thread to get the peak of a stage
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak_mb = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, registry.rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak_mb = registry.rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, registry.rss_mb())
+
+
+def run_end_to_end(category: str, num_of_site: int, model_to_test: str) -> dict:
+    """
+    run every stage of an analysis once, with models and scraped pages set by environment variables
+    :param category: str: category to scrape
+    :param num_of_site: int: number of sites to scrape (0 for all sites)
+    :param model_to_test: str: a camemBERT backend or 'default'
+    :return: dict: number of reviews, duration and peak memory of every stage
+    """
+    import pipeline
+    import scraping
+    stages = {}
+
+    def run_stage(name, function, *args):
+        with PeakMemory() as memory:
+            result, duration = timed(function, *args)
+        stages[name] = {'seconds': round(duration, 4), 'peak_mb': round(memory.peak_mb, 1)}
+        return result
+
+    # models are loaded before scraping so that loading is not counted in prediction
+    names = [model_to_test] if model_to_test in model.CAMEMBERT_BACKENDS else ['word2vec', 'bigram']
+    run_stage('loading', registry.preload, names)
+    refs, df = run_stage('scraping', scraping.scrape, category, 'no city', num_of_site, 0)
+    nb_reviews = len(df)
+    df = run_stage('preprocess', process.preprocess_df, df)
+    df = run_stage('prediction', pipeline.predict, df, model_to_test)
+    run_stage('postprocess', process.postprocess, df, refs)
+    return {'sites': len(refs[1]), 'reviews': nb_reviews, 'stages': stages,
+            'rss_mb': registry.memory_usage()['rss_mb']}
+
+
+def bench_end_to_end(sizes=(4, 20, 100), models=('default', 'camembert'), output='benchmark_end_to_end.json'):
+    """
+    scrape, preprocess, predict and postprocess sites replaying recorded pages, with stand-in models,
+    every size and model runs in a new process with empty caches so that durations and memory are comparable
+    results are written as json in output
+    """
+    import subprocess
+    import tempfile
+    model_dir = STAND_IN_DIR
+    if not os.path.isdir(os.path.join(model_dir, 'camembert-base')):
+        make_stand_in_models(model_dir)
+
+    print(' End to end '.center(50, '#'))
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as pages_dir:
+            stub_server.synthesize(pages_dir, size)
+            server = stub_server.start(pages_dir)
+            for model_to_test in models:
+                with tempfile.TemporaryDirectory() as run_dir:
+                    env = dict(os.environ,
+                               TRUSTPILOT_URL=f'http://127.0.0.1:{server.server_address[1]}',
+                               HTTP_CACHE='off', SCRAPING_RATE='0', SCRAPING_HOST_RATE='0',
+                               SENTIMENT_CACHE_DIR=run_dir,
+                               SENTIMENT_MODEL_DIR=os.path.abspath(model_dir),
+                               CAMEMBERT_BASE=os.path.abspath(os.path.join(model_dir, 'camembert-base')))
+                    result_file = os.path.join(run_dir, 'result.json')
+                    subprocess.run([sys.executable, os.path.abspath(__file__), 'end_to_end_run', result_file,
+                                    'restaurants_bars', str(size), model_to_test],
+                                   env=env, check=True, stdout=subprocess.DEVNULL)
+                    with open(result_file) as file:
+                        result = dict(size=size, model=model_to_test, **json.load(file))
+                results.append(result)
+                print(f"{size:>5} sites {model_to_test:>9} : {result['reviews']:>6} reviews | "
+                      + ' | '.join(f"{name} {stage['seconds']:.2f}s {stage['peak_mb']:.0f}MB"
+                                   for name, stage in result['stages'].items()))
+            server.shutdown()
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Results written in {output}')
+    return results
+
+
+BENCHMARKS = {
+    'average_vector': bench_average_vector,
+    'preprocess': bench_preprocess,
+    'parse': bench_parse,
+    'word_cloud': bench_word_cloud,
+    'count_words': bench_count_words,
+    'windows': bench_windows,
+    'camembert': bench_camembert,
+    'import_time': bench_import_time,
+    'end_to_end': bench_end_to_end,
+}
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['end_to_end_run']:
+        # one run of bench_end_to_end: result file, category, number of sites, model
+        end_to_end = run_end_to_end(sys.argv[3], int(sys.argv[4]), sys.argv[5])
+        with open(sys.argv[2], 'w') as result_file:
+            json.dump(end_to_end, result_file)
+    else:
+        # run benchmarks given on command line (all if none)
+        for name in sys.argv[1:] or BENCHMARKS:
+            BENCHMARKS[name]()
@@ -0,0 +1,197 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# directory of on-disk caches
+CACHE_DIR = os.environ.get('SENTIMENT_CACHE_DIR', 'cache')
+
+# max number of keys per SQLite query
+CHUNK_SIZE = 500
+# share of max_entries evicted in addition to the values above it
+EVICTION_MARGIN = 0.1
+
+
+def text_key(txt: str) -> str:
+    """
+    hash a text to use it as cache key
+    :param txt: str: text to hash
+    :return: str: hexadecimal sha1 of the text
+    """
+    return hashlib.sha1(txt.encode('utf-8')).hexdigest()
+
+
+class Cache:
+    """
+    bounded in-memory LRU in front of a SQLite table, values are stored as json
+    """
+
+    def __init__(self, name: str, memory_size: int = 10000, max_age: float = None, max_entries: int = None):
+        """
+        :param name: str: name of the cache, also name of the SQLite file in CACHE_DIR
+        :param memory_size: int: max number of values kept in memory
+        :param max_age: float: seconds after which a value is evicted (never if None)
+        :param max_entries: int: max number of values kept on disk, oldest are evicted first (no limit if None)
+        """
+        self.name = name
+        self.path = os.path.join(CACHE_DIR, f'{name}.sqlite')
+        self.memory_size = memory_size
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        # estimate of the number of values on disk, the table is counted again only when it goes above max_entries
+        self._nb_entries = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # connection is opened on first use and again in forked processes
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS cache '
+                                     '(key TEXT PRIMARY KEY, value TEXT, created REAL DEFAULT 0)')
+            # caches created before eviction by age have no creation time
+            columns = [row[1] for row in self._connection.execute('PRAGMA table_info(cache)')]
+            if 'created' not in columns:
+                self._connection.execute('ALTER TABLE cache ADD COLUMN created REAL DEFAULT 0')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS cache_created ON cache (created)')
+            self._pid = os.getpid()
+        return self._connection
+
+    def _expired(self, created: float) -> bool:
+        return self.max_age is not None and created < time.time() - self.max_age
+
+    def _remember(self, key: str, value, created: float):
+        self.memory[key] = (created, value)
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def _lookup(self, keys: list) -> dict:
+        # creation time and value of the keys found in cache
+        found = {}
+        with self._lock:
+            missing = []
+            for key in dict.fromkeys(keys):
+                if key in self.memory and not self._expired(self.memory[key][0]):
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+                else:
+                    missing.append(key)
+
+            connection = self._connect()
+            for start in range(0, len(missing), CHUNK_SIZE):
+                chunk = missing[start:start + CHUNK_SIZE]
+                rows = connection.execute(
+                    f"SELECT key, value, created FROM cache WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                for key, value, created in rows:
+                    if not self._expired(created):
+                        found[key] = (created, json.loads(value))
+                        self._remember(key, found[key][1], created)
+
+            nb_hits = sum(key in found for key in keys)
+            self.hits += nb_hits
+            self.misses += len(keys) - nb_hits
+        metrics.cache_lookup(self.name, nb_hits, len(keys) - nb_hits)
+        return found
+
+    def get_many(self, keys: list) -> dict:
+        """
+        get cached values
+        :param keys: list: keys to look for
+        :return: dict: values of the keys found in cache
+        """
+        return {key: value for key, (created, value) in self._lookup(keys).items()}
+
+    def get(self, key: str):
+        """
+        get a cached value
+        :param key: str: key to look for
+        :return: cached value, None if key is not in cache
+        """
+        return self.get_many([key]).get(key)
+
+    def get_with_age(self, key: str) -> tuple:
+        """
+        get a cached value and the time since it was cached
+        :param key: str: key to look for
+        :return: tuple: cached value and its age in seconds, (None, None) if key is not in cache
+        """
+        found = self._lookup([key])
+        if key not in found:
+            return None, None
+        created, value = found[key]
+        return value, time.time() - created
+
+    def set_many(self, values: dict):
+        """
+        add values to the cache
+        :param values: dict: values per key
+        """
+        created = time.time()
+        with self._lock:
+            for key, value in values.items():
+                self._remember(key, value, created)
+            connection = self._connect()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)',
+                                       [(key, json.dumps(value), created) for key, value in values.items()])
+            self._evict(connection, len(values))
+
+    def _count(self, connection: sqlite3.Connection) -> int:
+        # full scan of the table, only run at first eviction and when the estimate goes above max_entries
+        return connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def _evict(self, connection: sqlite3.Connection, nb_written: int):
+        # remove values older than max_age, then oldest values above max_entries
+        # the number of values is estimated from the values written, replaced values and values written
+        # by other processes make it approximate, it is corrected each time the table is counted
+        with connection:
+            if self.max_age is not None:
+                deleted = connection.execute('DELETE FROM cache WHERE created < ?',
+                                             (time.time() - self.max_age,)).rowcount
+                if self._nb_entries is not None:
+                    self._nb_entries -= deleted
+            if self.max_entries is not None:
+                if self._nb_entries is None:
+                    self._nb_entries = self._count(connection)
+                else:
+                    self._nb_entries += nb_written
+                if self._nb_entries > self.max_entries:
+                    self._nb_entries = self._count(connection)
+                if self._nb_entries > self.max_entries:
+                    # EVICTION_MARGIN more values are removed, so that next writes do not count the table again
+                    nb_evicted = self._nb_entries - int(self.max_entries * (1 - EVICTION_MARGIN))
+                    connection.execute('DELETE FROM cache WHERE key IN '
+                                       '(SELECT key FROM cache ORDER BY created LIMIT ?)', (nb_evicted,))
+                    self._nb_entries -= nb_evicted
+
+    def set(self, key: str, value):
+        self.set_many({key: value})
+
+    def stats(self) -> dict:
+        """
+        :return: dict: number of hits and misses since start
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        """
+        remove every value from memory and disk
+        """
+        with self._lock:
+            self.memory.clear()
+            connection = self._connect()
+            with connection:
+                connection.execute('DELETE FROM cache')
+            self._nb_entries = 0
+
@@ -0,0 +1,74 @@
+import sys
+import numpy as np
+
+import model
+
+# max difference between keras and numpy outputs
+TOLERANCE = 1e-5
+# layers without effect at prediction time
+SKIPPED_LAYERS = ['InputLayer', 'Dropout', 'Flatten']
+
+
+def load_keras_model(json_file: str = model.BIGRAM_JSON_FILE, weights_file: str = model.BIGRAM_WEIGHTS_FILE):
+    # tensorflow is only needed to read the keras files
+    from keras.models import model_from_json
+    with open(json_file, 'r') as file:
+        keras_model = model_from_json(file.read())
+    keras_model.load_weights(weights_file)
+    return keras_model
+
+
+def convert(json_file: str = model.BIGRAM_JSON_FILE, weights_file: str = model.BIGRAM_WEIGHTS_FILE,
+            npz_file: str = model.BIGRAM_NPZ_FILE):
+    """
+    save kernel, bias and activation of every dense layer of the keras model in a npz file read by model.py
+    :param json_file: str: architecture of the keras model
+    :param weights_file: str: weights of the keras model
+    :param npz_file: str: converted weights
+    :return: keras model
+    """
+    keras_model = load_keras_model(json_file, weights_file)
+    weights = {}
+    activations = []
+    for layer in keras_model.layers:
+        layer_type = layer.__class__.__name__
+        if layer_type in SKIPPED_LAYERS:
+            continue
+        if layer_type != 'Dense':
+            raise ValueError(f'Layer {layer.name} ({layer_type}) can not be converted')
+        activation = layer.get_config()['activation']
+        if activation not in model.ACTIVATIONS:
+            raise ValueError(f'Activation {activation} of layer {layer.name} can not be converted')
+        layer_weights = layer.get_weights()
+        kernel = layer_weights[0]
+        bias = layer_weights[1] if layer.use_bias else np.zeros(kernel.shape[1])
+        weights[f'kernel_{len(activations)}'] = kernel.astype("float32")
+        weights[f'bias_{len(activations)}'] = bias.astype("float32")
+        activations.append(activation)
+
+    np.savez(npz_file, activations=np.array(activations), **weights)
+    print(f'{len(activations)} dense layers converted in {npz_file}')
+    return keras_model
+
+
+def check_parity(keras_model, npz_file: str = model.BIGRAM_NPZ_FILE, size: int = 10000, seed: int = 0) -> float:
+    """
+    compare keras and numpy outputs on random vectors
+    :param keras_model: keras model
+    :param npz_file: str: converted weights
+    :param size: int: number of vectors
+    :param seed: int: seed of random vectors
+    :return: float: max difference of outputs
+    """
+    layers = model.load_bigram_model(npz_file)
+    inputs = np.random.default_rng(seed).standard_normal((size, layers[0][0].shape[0])).astype("float32")
+    difference = float(np.abs(keras_model.predict(inputs) - model.dense_forward(layers, inputs)).max())
+    print(f'Max difference between keras and numpy outputs : {difference:.2e}')
+    return difference
+
+
+if __name__ == '__main__':
+    # python convert_bigram.py [model json file] [weights h5 file] [npz file]
+    converted_model = convert(*sys.argv[1:4])
+    if check_parity(converted_model, *sys.argv[3:4]) > TOLERANCE:
+        sys.exit('Converted model does not match the keras model')
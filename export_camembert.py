@@ -0,0 +1,81 @@
+import sys
+import numpy as np
+import torch
+
+import model
+
+# max mean difference of logits between torch and onnx float32
+ONNX_TOLERANCE = 1e-3
+# min share of identical predictions between torch and onnx int8
+INT8_AGREEMENT = 0.98
+
+
+def export(onnx_file: str = model.CAMEMBERT_ONNX_FILE, int8_file: str = model.CAMEMBERT_INT8_FILE,
+           opset: int = 12):
+    """
+    export fine-tuned camemBERT to onnx, then quantize its weights to int8
+    onnxruntime optimizes the graph when the file is loaded (see model.load_camembert_onnx)
+    :param onnx_file: str: onnx float32 file
+    :param int8_file: str: onnx file with int8 weights
+    :param opset: int: onnx opset version
+    """
+    # optional dependency, only needed for the onnx backends
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    # 1. Load a new copy of camemBERT on cpu, giving logits as a tuple instead of a dict
+    camembert, tokenizer = model.load_camembert()
+    camembert.to(torch.device('cpu'))
+    camembert.config.return_dict = False
+
+    # 2. Export to onnx with variable number and length of comments
+    dummy = tokenizer(['Très bon service, livraison rapide.',
+                       'Commande jamais reçue, le service client ne répond pas.'], padding=True, return_tensors='pt')
+    torch.onnx.export(camembert, (dummy['input_ids'], dummy['attention_mask']), onnx_file,
+                      input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+                      dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                                    'attention_mask': {0: 'batch', 1: 'sequence'},
+                                    'logits': {0: 'batch'}},
+                      opset_version=opset, do_constant_folding=True)
+    print(f'CamemBERT exported in {onnx_file}')
+
+    # 3. Quantize weights of matrix products to int8, activations are quantized at run time
+    quantize_dynamic(onnx_file, int8_file, weight_type=QuantType.QInt8)
+    print(f'CamemBERT int8 exported in {int8_file}')
+
+
+def check_parity(comments: list, backends=('camembert_onnx', 'camembert_int8'), size: int = model.batch_size) -> dict:
+    """
+    compare logits and predictions of onnx backends with the torch model
+    :param comments: list: 'titre comment' of reviews
+    :param backends: list: backends compared with 'camembert'
+    :param size: int: number of reviews per mini-batch
+    :return: dict: mean and max difference of logits, share of identical predictions, per backend
+    """
+    reference = model.camembert_logits(comments, size, 'camembert')
+    parity = {}
+    for backend in backends:
+        logits = model.camembert_logits(comments, size, backend)
+        difference = np.abs(logits - reference)
+        parity[backend] = {
+            'mean_difference': float(difference.mean()),
+            'max_difference': float(difference.max()),
+            'agreement': float(np.mean(np.argmax(logits, axis=1) == np.argmax(reference, axis=1)))
+        }
+        print(f"{backend:>15} : logits difference mean {parity[backend]['mean_difference']:.5f} "
+              f"max {parity[backend]['max_difference']:.5f} | same prediction {parity[backend]['agreement']:.1%}")
+    return parity
+
+
+if __name__ == '__main__':
+    # python export_camembert.py [file of comments to check, one per line]
+    export()
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as file:
+            test_comments = [line.strip() for line in file if line.strip()]
+    else:
+        import benchmark
+        test_comments = benchmark.fixture_comments() + benchmark.make_texts(500)
+    results = check_parity(test_comments)
+    if (results['camembert_onnx']['mean_difference'] > ONNX_TOLERANCE
+            or results['camembert_int8']['agreement'] < INT8_AGREEMENT):
+        sys.exit('Exported camemBERT does not match the torch model')
@@ -0,0 +1,278 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+import cache
+import metrics
+
+# trustpilot url, can be replaced by a local stub server (see stub_server.py)
+BASE_URL = os.environ.get('TRUSTPILOT_URL', 'https://fr.trustpilot.com')
+
+# number of sites scraped in parallel
+WORKERS = int(os.environ.get('SCRAPING_WORKERS', 8))
+# max number of requests per second, for all hosts and for each host
+RATE = float(os.environ.get('SCRAPING_RATE', 10))
+HOST_RATE = float(os.environ.get('SCRAPING_HOST_RATE', 4))
+# max number of requests running at the same time on each host
+HOST_CONCURRENCY = int(os.environ.get('SCRAPING_HOST_CONCURRENCY', 4))
+# timeout of first try and of retry, in seconds
+TIMEOUTS = (1, 30)
+
+# http cache: 'on' to cache pages, 'off' to always download them,
+# 'only' to serve pages from cache without any request (pages not in cache are empty)
+HTTP_CACHE = os.environ.get('HTTP_CACHE', 'on')
+# seconds before a cached page is revalidated, per url type (first part of the url path)
+HTTP_CACHE_TTL = {
+    'categories': 24 * 3600,
+    'search': 7 * 24 * 3600,
+    'review': 3600,
+}
+# cached pages not fetched again for HTTP_CACHE_DAYS days are evicted, then oldest pages above HTTP_CACHE_SIZE pages
+HTTP_CACHE_MAX_AGE = float(os.environ.get('HTTP_CACHE_DAYS', 30)) * 24 * 3600
+HTTP_CACHE_SIZE = int(os.environ.get('HTTP_CACHE_SIZE', 50000))
+# seconds between two checks of the age of cached pages
+EVICTION_INTERVAL = 3600
+
+
+class HttpCache:
+    """
+    gzip-compressed pages on local disk, with their ETag and Last-Modified headers
+    """
+
+    def __init__(self, directory: str = os.path.join(cache.CACHE_DIR, 'http'), ttl: dict = None,
+                 max_age: float = HTTP_CACHE_MAX_AGE, max_entries: int = HTTP_CACHE_SIZE):
+        """
+        :param directory: str: folder of cached pages
+        :param ttl: dict: seconds before a page is revalidated per url type
+        :param max_age: float: seconds after which a page not fetched again is evicted (never if None)
+        :param max_entries: int: max number of pages kept, oldest are evicted first (no limit if None)
+        """
+        self.directory = directory
+        self.ttl = HTTP_CACHE_TTL if ttl is None else ttl
+        self.max_age = max_age
+        self.max_entries = max_entries
+        # estimate of the number of pages, as in cache.Cache the folder is listed again only above max_entries
+        # (or every EVICTION_INTERVAL seconds to evict old pages)
+        self._nb_entries = None
+        self._checked_at = 0
+        self._evict_lock = threading.Lock()
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def is_fresh(self, url: str, meta: dict) -> bool:
+        url_type = urlsplit(url).path.strip('/').split('/')[0]
+        return time.time() - meta['fetched_at'] < self.ttl.get(url_type, 0)
+
+    def load(self, url: str) -> tuple:
+        """
+        :param url: str: url of the page
+        :return: tuple: headers of the cached page and its content, (None, None) if not in cache
+        """
+        path = self._path(url)
+        try:
+            with open(path + '.json') as file:
+                meta = json.load(file)
+            with gzip.open(path + '.html.gz', 'rb') as file:
+                return meta, file.read()
+        except (OSError, ValueError):
+            return None, None
+
+    def save(self, url: str, content: bytes, headers: dict, meta: dict = None):
+        """
+        :param url: str: url of the page
+        :param content: bytes: content of the page, None to keep the cached content
+        :param headers: dict: response headers
+        :param meta: dict: headers of the cached page, kept if the response does not repeat them
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(url)
+        # files are written under a temporary name, then renamed, so that readers never see half a file
+        tmp = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        if content is not None:
+            with gzip.open(path + '.html.gz' + tmp, 'wb') as file:
+                file.write(content)
+            os.replace(path + '.html.gz' + tmp, path + '.html.gz')
+        meta = meta or {}
+        meta = {
+            'url': url,
+            'etag': headers.get('ETag', meta.get('etag')),
+            'last_modified': headers.get('Last-Modified', meta.get('last_modified')),
+            'fetched_at': time.time()
+        }
+        with open(path + '.json' + tmp, 'w') as file:
+            json.dump(meta, file)
+        os.replace(path + '.json' + tmp, path + '.json')
+        self._evict()
+
+    def _remove(self, path: str):
+        for extension in ('.json', '.html.gz'):
+            try:
+                os.remove(path + extension)
+            except OSError:
+                pass
+
+    def _evict(self):
+        # same policy as cache.Cache: pages older than max_age, then oldest pages above max_entries
+        now = time.time()
+        if self._nb_entries is not None:
+            self._nb_entries += 1
+            over_size = self.max_entries is not None and self._nb_entries > self.max_entries
+            if not over_size and now - self._checked_at < EVICTION_INTERVAL:
+                return
+        # pages are evicted by one thread, the others go on
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = now
+            # meta file of a page is written each time the page is fetched or revalidated
+            entries = []
+            with os.scandir(self.directory) as files:
+                for file in files:
+                    if file.name.endswith('.json'):
+                        try:
+                            entries.append((file.stat().st_mtime, file.path[:-len('.json')]))
+                        except OSError:
+                            pass
+            if self.max_age is not None:
+                for _, path in [entry for entry in entries if entry[0] < now - self.max_age]:
+                    self._remove(path)
+                entries = [entry for entry in entries if entry[0] >= now - self.max_age]
+            if self.max_entries is not None and len(entries) > self.max_entries:
+                # cache.EVICTION_MARGIN more pages are removed, so that next writes do not list the folder again
+                entries.sort()
+                nb_evicted = len(entries) - int(self.max_entries * (1 - cache.EVICTION_MARGIN))
+                for _, path in entries[:nb_evicted]:
+                    self._remove(path)
+                entries = entries[nb_evicted:]
+            self._nb_entries = len(entries)
+        finally:
+            self._evict_lock.release()
+
+
+class RateLimiter:
+    """
+    space requests so that no more than rate requests per second are sent
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            send_time = max(now, self.next_time)
+            self.next_time = send_time + self.interval
+        time.sleep(send_time - now)
+
+
+class Fetcher:
+    """
+    fetch pages on a shared connection-pooled session, with a global rate limit
+    and a rate and concurrency limit per host
+    """
+
+    def __init__(self, headers: dict = None, workers: int = WORKERS, rate: float = RATE,
+                 host_rate: float = HOST_RATE, host_concurrency: int = HOST_CONCURRENCY,
+                 cache_mode: str = HTTP_CACHE, http_cache: HttpCache = None):
+        """
+        :param headers: dict: headers sent with every request
+        :param workers: int: number of sites fetched in parallel
+        :param rate: float: max number of requests per second
+        :param host_rate: float: max number of requests per second on each host
+        :param host_concurrency: int: max number of requests at the same time on each host
+        :param cache_mode: str: 'on', 'off' or 'only' (see HTTP_CACHE)
+        :param http_cache: HttpCache: cache of pages (default folder if None)
+        """
+        self.workers = workers
+        self.cache_mode = cache_mode
+        self.http_cache = http_cache or HttpCache()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self.rate_limiter = RateLimiter(rate)
+        self.host_rate = host_rate
+        self.host_concurrency = host_concurrency
+        self.host_limiters = {}
+        self.host_slots = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url: str) -> tuple:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.host_limiters:
+                self.host_limiters[host] = RateLimiter(self.host_rate)
+                self.host_slots[host] = threading.Semaphore(self.host_concurrency)
+        return self.host_limiters[host], self.host_slots[host]
+
+    def _request(self, url: str, headers: dict = None) -> requests.Response:
+        host_limiter, host_slot = self._host(url)
+        with host_slot:
+            host_limiter.wait()
+            self.rate_limiter.wait()
+            try:
+                return self.session.get(url, headers=headers, timeout=TIMEOUTS[0])
+            except requests.RequestException:
+                return self.session.get(url, headers=headers, timeout=TIMEOUTS[1])  # try request a second time
+
+    def get(self, url: str) -> bytes:
+        """
+        fetch a page, from cache if it is still fresh or not modified since it was cached
+        :param url: str: url of the page
+        :return: bytes: content of the page
+        """
+        if self.cache_mode == 'off':
+            return self._count('network', self._request(url).content)
+
+        meta, content = self.http_cache.load(url)
+        if self.cache_mode == 'only':
+            if content is None:
+                print(f'Not in http cache : {url}')
+            return self._count('cache', content or b'')
+        if content is not None and self.http_cache.is_fresh(url, meta):
+            return self._count('cache', content)
+
+        # ask the server if the cached page changed
+        headers = {}
+        if content is not None and meta['etag']:
+            headers['If-None-Match'] = meta['etag']
+        if content is not None and meta['last_modified']:
+            headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            req = self._request(url, headers)
+        except requests.RequestException as error:
+            if content is None:
+                raise
+            print(f'Cached page used, {url} could not be fetched : {error!r}')
+            return self._count('stale', content)
+
+        if req.status_code == 304:
+            self.http_cache.save(url, None, req.headers, meta)
+            return self._count('not_modified', content)
+        if req.status_code == 200:
+            self.http_cache.save(url, req.content, req.headers)
+        elif content is not None:
+            # error page (rate limit, server error): the cached page is better than nothing
+            print(f'Cached page used, {url} answered {req.status_code}')
+            return self._count('stale', content)
+        return self._count('network', req.content)
+
+    @staticmethod
+    def _count(source: str, content: bytes) -> bytes:
+        # pages and bytes fetched per source: network, cache, not_modified (revalidated cache)
+        # or stale (cached page used because the page could not be fetched)
+        metrics.HTTP_FETCHES.labels(source).inc()
+        metrics.HTTP_BYTES.labels(source).inc(len(content))
+        return content
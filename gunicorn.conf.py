@@ -0,0 +1,17 @@
+import os
+
+# start with: gunicorn -c gunicorn.conf.py wsgi:app
+bind = os.environ.get('BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('WEB_WORKERS', 2))
+threads = int(os.environ.get('WEB_THREADS', 4))
+# analyses can take minutes, long ones should use /jobs
+timeout = int(os.environ.get('WEB_TIMEOUT', 600))
+# load application and models once in the master process before forking workers
+preload_app = True
+
+
+def child_exit(server, worker):
+    # metrics of a stopped worker are kept in prometheus_multiproc_dir, mark them as dead for gauges
+    if os.environ.get('prometheus_multiproc_dir') or os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
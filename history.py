@@ -0,0 +1,61 @@
+import os
+import json
+import sqlite3
+import threading
+
+import cache
+
+# reviews already scraped per site, for incremental scraping
+HISTORY_PATH = os.path.join(cache.CACHE_DIR, 'history.sqlite')
+
+_lock = threading.Lock()
+_connection = None
+_pid = None
+
+
+def _connect() -> sqlite3.Connection:
+    global _connection, _pid
+    # connection is opened on first use and again in forked processes
+    if _connection is None or _pid != os.getpid():
+        os.makedirs(os.path.dirname(HISTORY_PATH) or '.', exist_ok=True)
+        _connection = sqlite3.connect(HISTORY_PATH, check_same_thread=False)
+        _connection.execute('CREATE TABLE IF NOT EXISTS reviews (site TEXT, date TEXT, info TEXT, '
+                            'UNIQUE (site, info))')
+        _connection.execute('CREATE INDEX IF NOT EXISTS reviews_site_date ON reviews (site, date)')
+        _pid = os.getpid()
+    return _connection
+
+
+def newest_date(site: str) -> str:
+    """
+    get the publishedDate of the newest review stored for a site
+    :param site: str: site name
+    :return: str: publishedDate, None if no review is stored
+    """
+    with _lock:
+        return _connect().execute('SELECT MAX(date) FROM reviews WHERE site = ?', (site,)).fetchone()[0]
+
+
+def load(site: str) -> list:
+    """
+    get the reviews stored for a site, newest first
+    :param site: str: site name
+    :return: list: infos of every review as scraped by scrape_site
+    """
+    with _lock:
+        rows = _connect().execute('SELECT info FROM reviews WHERE site = ? ORDER BY date DESC, rowid',
+                                  (site,)).fetchall()
+    return [json.loads(info) for info, in rows]
+
+
+def save(site: str, infos: list):
+    """
+    add reviews of a site to history, reviews already stored are ignored
+    :param site: str: site name
+    :param infos: list: infos of every review as scraped by scrape_site, the date being the last info
+    """
+    with _lock:
+        connection = _connect()
+        with connection:
+            connection.executemany('INSERT OR IGNORE INTO reviews (site, date, info) VALUES (?, ?, ?)',
+                                   [(site, info[-1], json.dumps(info, ensure_ascii=False)) for info in infos])
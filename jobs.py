@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+import pipeline
+
+# number of analyses running at the same time in each worker, other jobs wait in queue
+WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# seconds during which a finished job can be read
+JOB_TTL = float(os.environ.get('JOB_TTL', 3600))
+# max number of jobs queued or running in all workers, new analyses are refused above
+JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 32))
+# jobs of every worker, so that any worker can answer /jobs/<id> and identical analyses are shared
+JOBS_PATH = os.path.join(cache.CACHE_DIR, 'jobs.sqlite')
+
+_executor = ThreadPoolExecutor(WORKERS, thread_name_prefix='job')
+# functions to call with the result of the jobs run by this process
+_callbacks = {}
+_lock = threading.Lock()
+_connection = None
+_pid = None
+
+
+class QueueFull(Exception):
+    """
+    raised when JOB_QUEUE_LIMIT jobs are already queued or running
+    """
+
+
+def _connect() -> sqlite3.Connection:
+    global _connection, _pid
+    # connection is opened on first use and again in forked processes
+    if _connection is None or _pid != os.getpid():
+        os.makedirs(os.path.dirname(JOBS_PATH) or '.', exist_ok=True)
+        _connection = sqlite3.connect(JOBS_PATH, check_same_thread=False)
+        _connection.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, key TEXT, pid INTEGER, '
+                            'params TEXT, status TEXT, stage TEXT, stages TEXT, created_at REAL, '
+                            'started_at REAL, finished_at REAL, result TEXT, error TEXT)')
+        # one unfinished job per set of parameters
+        _connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS jobs_in_flight ON jobs (key) '
+                            'WHERE finished_at IS NULL')
+        _pid = os.getpid()
+    return _connection
+
+
+def params_key(params: dict) -> str:
+    """
+    :param params: dict: parameters from pipeline.get_params
+    :return: str: key identical for identical analyses
+    """
+    return json.dumps(params, sort_keys=True)
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _expire(connection: sqlite3.Connection):
+    # remove finished jobs older than JOB_TTL
+    connection.execute('DELETE FROM jobs WHERE finished_at < ?', (time.time() - JOB_TTL,))
+    # jobs of stopped workers will never finish
+    for job_id, pid in connection.execute('SELECT id, pid FROM jobs WHERE finished_at IS NULL').fetchall():
+        if not _is_alive(pid):
+            connection.execute("UPDATE jobs SET status = 'error', error = ?, finished_at = ? WHERE id = ?",
+                               (f'worker {pid} stopped', time.time(), job_id))
+
+
+def _update(job_id: str, **values):
+    with _lock:
+        connection = _connect()
+        with connection:
+            connection.execute(f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in values)} WHERE id = ?",
+                               [*values.values(), job_id])
+
+
+def _run(job_id: str, params: dict):
+    stages = {stage: 'pending' for stage in pipeline.STAGES}
+
+    def progress(stage: str, status: str):
+        stages[stage] = status
+        _update(job_id, stage=stage, stages=json.dumps(stages))
+
+    def skip():
+        # stages not run because no review was found or a previous stage failed
+        for stage, status in stages.items():
+            if status == 'pending':
+                stages[stage] = 'skipped'
+        return json.dumps(stages)
+
+    _update(job_id, status='running', started_at=time.time())
+    try:
+        result = pipeline.analyse(params, progress)
+    except Exception as error:
+        _update(job_id, status='error', stages=skip(), error=repr(error), finished_at=time.time())
+        with _lock:
+            _callbacks.pop(job_id, None)
+        return
+    _update(job_id, status='done', stages=skip(), result=json.dumps(result, ensure_ascii=False),
+            finished_at=time.time())
+    with _lock:
+        callbacks = _callbacks.pop(job_id, [])
+    for callback in callbacks:
+        callback(result)
+
+
+def submit(params: dict, callback=None) -> str:
+    """
+    queue an analysis, an identical analysis already queued or running in any worker is reused
+    :param params: dict: parameters from pipeline.get_params
+    :param callback: function called with the result once the analysis is done,
+    only if the analysis runs in this worker
+    :return: str: id of the job
+    :raise QueueFull: if JOB_QUEUE_LIMIT jobs are queued or running and no identical job is among them
+    """
+    key = params_key(params)
+    job_id = uuid.uuid4().hex
+    with _lock:
+        connection = _connect()
+        with connection:
+            _expire(connection)
+            in_flight = connection.execute('SELECT id FROM jobs WHERE key = ? AND finished_at IS NULL',
+                                           (key,)).fetchone()
+            nb_unfinished = connection.execute('SELECT COUNT(*) FROM jobs WHERE finished_at IS NULL').fetchone()[0]
+            if in_flight is None and nb_unfinished >= JOB_QUEUE_LIMIT:
+                raise QueueFull(f'{nb_unfinished} jobs queued or running')
+            # ignored if an identical job is not finished
+            connection.execute('INSERT OR IGNORE INTO jobs (id, key, pid, params, status, stages, created_at) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (job_id, key, os.getpid(), json.dumps(params), 'pending',
+                                json.dumps({stage: 'pending' for stage in pipeline.STAGES}), time.time()))
+            in_flight_id, pid = connection.execute('SELECT id, pid FROM jobs WHERE key = ? AND finished_at IS NULL',
+                                                   (key,)).fetchone()
+        if callback and pid == os.getpid():
+            _callbacks.setdefault(in_flight_id, []).append(callback)
+    if in_flight_id == job_id:
+        _executor.submit(_run, job_id, params)
+    return in_flight_id
+
+
+def get(job_id: str) -> dict:
+    """
+    get status, progress per stage and result of a job
+    :param job_id: str: id of the job
+    :return: dict: job, None if the job does not exist or expired
+    """
+    with _lock:
+        connection = _connect()
+        with connection:
+            _expire(connection)
+        row = connection.execute('SELECT id, params, status, stage, stages, created_at, started_at, finished_at, '
+                                 'result, error FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(zip(['id', 'params', 'status', 'stage', 'stages', 'created_at', 'started_at', 'finished_at',
+                    'result', 'error'], row))
+    for column in ['params', 'stages', 'result']:
+        if job[column] is not None:
+            job[column] = json.loads(job[column])
+    return job
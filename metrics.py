@@ -0,0 +1,87 @@
+import os
+import io
+import time
+import pstats
+import cProfile
+from datetime import datetime
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, generate_latest, multiprocess
+
+# durations of analysis stages, from a few milliseconds to several minutes
+STAGE_SECONDS = Histogram('sentiment_stage_seconds', 'Duration of analysis stages', ['stage'],
+                          buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf')))
+HTTP_FETCHES = Counter('sentiment_http_fetches_total', 'Trustpilot pages fetched, by source of the page',
+                       ['source'])
+HTTP_BYTES = Counter('sentiment_http_bytes_total', 'Bytes of trustpilot pages fetched, by source of the page',
+                     ['source'])
+REVIEWS = Counter('sentiment_reviews_total', 'Reviews going through each stage', ['stage'])
+CACHE_REQUESTS = Counter('sentiment_cache_requests_total', 'Cache lookups, by cache and result',
+                         ['cache', 'result'])
+BATCH_SIZE = Histogram('sentiment_model_batch_size', 'Number of reviews per model batch', ['model'],
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, float('inf')))
+
+
+@contextmanager
+def stage(name: str, progress=None):
+    """
+    time a stage of an analysis, print its duration and record it in STAGE_SECONDS, also when the stage fails
+    :param name: str: name of the stage
+    :param progress: function called with the name of the stage and 'running', then 'done' or 'error'
+    """
+    if progress:
+        progress(name, 'running')
+    init_time = datetime.now()
+    print(f' Start {name} '.center(30, '#'))
+    status = 'error'
+    try:
+        yield
+        status = 'done'
+    finally:
+        time_elapsed = datetime.now() - init_time
+        STAGE_SECONDS.labels(name).observe(time_elapsed.total_seconds())
+        print(f'{name.capitalize()} time : {time_elapsed}' + (' (failed)' if status == 'error' else ''))
+        if progress:
+            progress(name, status)
+
+
+def cache_lookup(cache_name: str, hits: int, misses: int):
+    CACHE_REQUESTS.labels(cache_name, 'hit').inc(hits)
+    CACHE_REQUESTS.labels(cache_name, 'miss').inc(misses)
+
+
+def export() -> bytes:
+    """
+    get metrics in Prometheus text format, gathered from every worker
+    when prometheus_multiproc_dir is set (see gunicorn.conf.py)
+    :return: bytes: metrics
+    """
+    if os.environ.get('prometheus_multiproc_dir') or os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def profile(function, *args, backend: str = 'cprofile') -> tuple:
+    """
+    run a function under a profiler
+    :param function: function to profile
+    :param backend: str: 'cprofile' or 'pyinstrument' (needs pip install pyinstrument)
+    :return: tuple: result of the function, profile as text
+    """
+    if backend == 'pyinstrument':
+        # optional dependency, only needed for this profiler
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        result = function(*args)
+        profiler.stop()
+        return result, profiler.output_text()
+
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    result = profiler.runcall(function, *args)
+    stats = io.StringIO()
+    stats.write(f'Total time : {time.perf_counter() - start:.3f}s\n')
+    pstats.Stats(profiler, stream=stats).sort_stats('cumulative').print_stats(50)
+    return result, stats.getvalue()
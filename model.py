@@ -1,125 +1,336 @@
+import os
+import json
 import pandas as pd
 import numpy as np
-from gensim.models import Word2Vec, Phrases
-from keras.models import model_from_json
-import torch
-from transformers import CamembertTokenizer, CamembertForSequenceClassification
-from keras.preprocessing.sequence import pad_sequences
+from datetime import datetime
+from functools import lru_cache
+from scipy.sparse import csr_matrix
+
+import cache
+import metrics
+import registry
 
 MAX_LEN = 128
-batch_size = 16
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# number of reviews per camemBERT mini-batch
+batch_size = int(os.environ.get('CAMEMBERT_BATCH_SIZE', 16))
 
+# weight files downloaded by model_weights.sh, in SENTIMENT_MODEL_DIR (default current folder)
+MODEL_DIR = os.environ.get('SENTIMENT_MODEL_DIR', '')
+WORD2VEC_FILE = os.path.join(MODEL_DIR, '100features_40minwords_20context_bigram')
+BIGRAM_JSON_FILE = os.path.join(MODEL_DIR, 'model_bigram.json')
+BIGRAM_WEIGHTS_FILE = os.path.join(MODEL_DIR, 'model_bigram.h5')
+# weights of the dense model converted by convert_bigram.py, read without tensorflow
+BIGRAM_NPZ_FILE = os.path.join(MODEL_DIR, 'model_bigram.npz')
+CAMEMBERT_FILE = os.path.join(MODEL_DIR, 'camemBERT_38000_state_dict.pt')
+# name or folder of the pretrained camemBERT configuration and tokenizer
+CAMEMBERT_BASE = os.environ.get('CAMEMBERT_BASE', 'camembert-base')
+# camemBERT exported by export_camembert.py, in float32 and with int8 quantized weights
+CAMEMBERT_ONNX_FILE = os.path.join(MODEL_DIR, 'camembert.onnx')
+CAMEMBERT_INT8_FILE = os.path.join(MODEL_DIR, 'camembert_int8.onnx')
+# camemBERT backends: torch model, onnxruntime float32 and onnxruntime int8
+CAMEMBERT_BACKENDS = ['camembert', 'camembert_onnx', 'camembert_int8']
+# threads of torch, set when camemBERT is loaded (threads from OMP_NUM_THREADS if not set)
+TORCH_THREADS = int(os.environ.get('TORCH_THREADS', 0))
 
-def aggregate_vector_model(words: list, model: Word2Vec, num_features: int):
-    # Pre-initialising empty numpy array for speed
-    feature_vec = np.zeros(num_features, dtype="float32")
-    counter = 0
 
-    # Converting Index2Word which is a list to a set for better speed in the execution.
-    index2word_set = set(model.wv.index2word)
+# gensim, torch and transformers are imported by the loaders of the models using them,
+# so that the api starts without them and the default model never imports torch
 
-    for word in words:
-        if word in index2word_set:
-            counter += 1
-            feature_vec = np.add(feature_vec, model[word])  # add word vectors element by element
 
-    # Dividing the result by number of words to get average
-    feature_vec = np.divide(feature_vec, counter)
-    return feature_vec
+@lru_cache(maxsize=None)
+def get_device():
+    import torch
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 
-# Function for calculating the average feature vector
-def get_average_vector_model(reviews: pd.Series, model: Word2Vec, num_features: int) -> np.array:
-    counter = 0
-    review_feature_vecs = np.zeros((len(reviews), num_features), dtype="float32")
+def load_word2vec() -> tuple:
+    # load pretrained Word2Vec model and keep only its vocabulary index and embeddings
+    from gensim.models import Word2Vec
+    return build_vocab_index(Word2Vec.load(WORD2VEC_FILE))
+
+
+def load_bigram_model(npz_file: str = BIGRAM_NPZ_FILE) -> list:
+    """
+    load the dense model converted by convert_bigram.py
+    :param npz_file: str: converted weights
+    :return: list: (kernel, bias, activation) of every dense layer
+    """
+    with np.load(npz_file) as weights:
+        return [(np.ascontiguousarray(weights[f'kernel_{i}'], dtype="float32"),
+                 np.ascontiguousarray(weights[f'bias_{i}'], dtype="float32"),
+                 str(activation))
+                for i, activation in enumerate(weights['activations'])]
+
+
+def load_camembert() -> tuple:
+    import torch
+    if TORCH_THREADS:
+        torch.set_num_threads(TORCH_THREADS)
+    from transformers import CamembertTokenizer, CamembertForSequenceClassification
+    state_dict = torch.load(CAMEMBERT_FILE, map_location=torch.device('cpu'))
+    model = CamembertForSequenceClassification.from_pretrained(CAMEMBERT_BASE, num_labels=2, state_dict=state_dict)
+    model.to(get_device())
+    model.eval()
+
+    # Initialize CamemBERT tokenizer
+    tokenizer = CamembertTokenizer.from_pretrained(CAMEMBERT_BASE, do_lower_case=True)
+    return model, tokenizer
+
+
+def load_camembert_onnx(path: str) -> tuple:
+    """
+    load camemBERT exported with export_camembert.py in an onnxruntime session
+    :param path: str: onnx file
+    :return: tuple: onnxruntime session, tokenizer
+    """
+    # optional dependency, only needed for the onnx backends, torch is not needed
+    import onnxruntime
+    from transformers import CamembertTokenizer
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # ONNX_THREADS, else the threads of torch set per worker in wsgi.py, else every cpu
+    options.intra_op_num_threads = int(os.environ.get('ONNX_THREADS') or os.environ.get('OMP_NUM_THREADS')
+                                       or os.cpu_count() or 1)
+    session = onnxruntime.InferenceSession(path, options)
+    tokenizer = CamembertTokenizer.from_pretrained(CAMEMBERT_BASE, do_lower_case=True)
+    return session, tokenizer
+
+
+registry.register('word2vec', load_word2vec, [WORD2VEC_FILE])
+registry.register('bigram', load_bigram_model, [BIGRAM_NPZ_FILE])
+registry.register('camembert', load_camembert, [CAMEMBERT_FILE])
+registry.register('camembert_onnx', lambda: load_camembert_onnx(CAMEMBERT_ONNX_FILE), [CAMEMBERT_ONNX_FILE])
+registry.register('camembert_int8', lambda: load_camembert_onnx(CAMEMBERT_INT8_FILE), [CAMEMBERT_INT8_FILE])
+
+# predictions by model version and review, evicted after PREDICTION_CACHE_DAYS days
+# or above PREDICTION_CACHE_SIZE predictions
+prediction_cache = cache.Cache('predictions',
+                               max_age=float(os.environ.get('PREDICTION_CACHE_DAYS', 30)) * 24 * 3600,
+                               max_entries=int(os.environ.get('PREDICTION_CACHE_SIZE', 1000000)))
 
+
+def build_vocab_index(model) -> tuple:
+    """
+    build once the index of the Word2Vec vocabulary
+    :param model: Word2Vec: pretrained Word2Vec model
+    :return: tuple: dict of word to row id, contiguous float32 embedding matrix
+    """
+    vocab = {word: i for i, word in enumerate(model.wv.index2word)}
+    embeddings = np.ascontiguousarray(model.wv.vectors, dtype="float32")
+    return vocab, embeddings
+
+
+# Function for calculating the average feature vector
+def get_average_vector_model(reviews: pd.Series, vocab: dict, embeddings: np.array) -> np.array:
+    """
+    average the word vectors of every review in a single sparse matrix product
+    :param reviews: series of list of words
+    :param vocab: dict: word to row id in embeddings
+    :param embeddings: np.array: embedding matrix (vocabulary size, number of features)
+    :return: np.array: average vector of each review, zeros for reviews without known words
+    """
+    # map words to ids, words out of the vocabulary are dropped
+    ids = []
+    indptr = [0]
     for review in reviews:
-        review_feature_vecs[counter] = aggregate_vector_model(review, model, num_features)
-        counter += 1
+        ids.extend(vocab[word] for word in review if word in vocab)
+        indptr.append(len(ids))
+    indptr = np.array(indptr)
 
-    return review_feature_vecs
+    # sparse (reviews, vocabulary) matrix with one entry per known word
+    words_matrix = csr_matrix((np.ones(len(ids), dtype="float32"), np.array(ids, dtype=int), indptr),
+                              shape=(len(indptr) - 1, len(embeddings)))
+    review_feature_vecs = np.asarray(words_matrix @ embeddings, dtype="float32")
 
+    # Dividing the sum by number of known words, reviews without known words stay at zero
+    counts = np.diff(indptr)[:, None]
+    return np.divide(review_feature_vecs, counts, out=np.zeros_like(review_feature_vecs), where=counts > 0)
 
-def vectorize(df, model, num_features):
-    df_vect = get_average_vector_model(df['review'], model, num_features)
-    df_vect = np.nan_to_num(df_vect)
-    return df_vect
 
+def softmax(x: np.array) -> np.array:
+    x = np.exp(x - x.max(axis=1, keepdims=True))
+    return x / x.sum(axis=1, keepdims=True)
 
-def predict(df: pd.DataFrame) -> pd.DataFrame:
+
+# activations of dense layers, applied in place
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'sigmoid': lambda x: np.divide(1, np.add(1, np.exp(-x, out=x), out=x), out=x),
+    'tanh': lambda x: np.tanh(x, out=x),
+    'softmax': softmax,
+}
+
+
+def dense_forward(layers: list, inputs: np.array, size: int = 4096) -> np.array:
     """
-    predict the sentiment of reviews
-    :param df: dataframe with reviews
-    :return: dataframe: dataframe with prediction of reviews
+    predict with the dense model, by batches of inputs
+    :param layers: list: (kernel, bias, activation) of every dense layer, from load_bigram_model
+    :param inputs: np.array: input vectors (number of inputs, number of features)
+    :param size: int: number of inputs per batch
+    :return: np.array: outputs of the last layer
     """
-    # load pretrained Word2Vec model
-    model = Word2Vec.load("100features_40minwords_20context_bigram")
+    outputs = []
+    for start in range(0, len(inputs), size):
+        x = np.asarray(inputs[start:start + size], dtype="float32")
+        for kernel, bias, activation in layers:
+            x = ACTIVATIONS[activation](x @ kernel + bias)
+        outputs.append(x)
+    if not outputs:
+        return np.zeros((0, layers[-1][0].shape[1]), dtype="float32")
+    return np.concatenate(outputs)
+
+
+def cached_predictions(names: list, inputs: list, predict_inputs) -> list:
+    """
+    get predictions from prediction_cache, only inputs not found are sent to the model
+    :param names: list: names in the registry of the models used for prediction
+    :param inputs: list: model input of every review, as string
+    :param predict_inputs: function predicting the sentiment of the inputs at the given positions
+    :return: list: sentiment of every review
+    """
+    # cached predictions are keyed by model name, version of its weight files and review hash,
+    # changing weight files changes every key
+    model_version = '+'.join(f'{name}:{registry.version(name)}' for name in names)
+    keys = [cache.text_key(f'{model_version}|{txt}') for txt in inputs]
+    cached = prediction_cache.get_many(keys)
+
+    positions = [i for i, key in enumerate(keys) if key not in cached]
+    if positions:
+        predictions = predict_inputs(positions)
+        new_predictions = {keys[i]: int(prediction) for i, prediction in zip(positions, predictions)}
+        prediction_cache.set_many(new_predictions)
+        cached.update(new_predictions)
+    print(f'Prediction cache : {len(keys) - len(positions)} hits, {len(positions)} misses')
+
+    return [cached[key] for key in keys]
+
+
+def predict_reviews(reviews: list) -> list:
+    """
+    predict the sentiment of preprocessed reviews with the Word2Vec and dense models
+    :param reviews: list: list of words of every review
+    :return: list: sentiment of every review
+    """
+    # get vocabulary and embeddings of pretrained Word2Vec model
+    vocab, embeddings = registry.get('word2vec')
     # transform words into vectors
-    df_vect = vectorize(df, model, 100)
+    df_vect = get_average_vector_model(reviews, vocab, embeddings)
 
-    # load json and create model
-    json_file = open('model_bigram.json', 'r')
-    loaded_model_json = json_file.read()
-    json_file.close()
-    loaded_model = model_from_json(loaded_model_json)
-    # load weights into new model
-    loaded_model.load_weights("model_bigram.h5")
-    loaded_model.compile(optimizer='rmsprop', loss='binary_crossentropy', metrics=['accuracy'])
+    # get pretrained dense model
+    loaded_model = registry.get('bigram')
+    metrics.BATCH_SIZE.labels('bigram').observe(len(reviews))
 
     # predict sentiment with pretrained model
-    predictions = loaded_model.predict(df_vect)
+    predictions = dense_forward(loaded_model, df_vect)
 
     # convert list of list of probabilities into list of probabilities
     predictions = [x for _list in predictions for x in _list]
     # Convert probabilities into binary predictions
-    predictions = [1 if i >= 0.5 else 0 for i in predictions]
+    return [1 if i >= 0.5 else 0 for i in predictions]
+
+
+def predict(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    predict the sentiment of reviews
+    :param df: dataframe with reviews
+    :return: dataframe: dataframe with prediction of reviews
+    """
+    reviews = [list(review) for review in df['review']]
+    predictions = cached_predictions(['word2vec', 'bigram'], [json.dumps(review) for review in reviews],
+                                     lambda positions: predict_reviews([reviews[i] for i in positions]))
     df = pd.DataFrame(data={"site": df["site"], "date": df["date"],
                             "review": df["review"], "sentiment": predictions})
     return df
 
 
-def predict_camembert(df: pd.DataFrame) -> pd.DataFrame:
+def bucket_batches(tokenized_comments_ids: list, size: int):
+    """
+    group encoded comments of similar length into mini-batches padded to their own longest comment
+    :param tokenized_comments_ids: list: encoded comments
+    :param size: int: number of comments per batch
+    :return: generator of (positions of the comments in the list, input ids, attention masks) as numpy arrays
+    """
+    # sort comments by length so that each batch holds comments of similar length
+    order = sorted(range(len(tokenized_comments_ids)), key=lambda i: len(tokenized_comments_ids[i]))
+    for start in range(0, len(order), size):
+        positions = order[start:start + size]
+        batch_len = max(len(tokenized_comments_ids[i]) for i in positions)
+        # Pad the encoded comments of the batch and create attention masks
+        inputs = np.zeros((len(positions), batch_len), dtype=np.int64)
+        masks = np.zeros((len(positions), batch_len), dtype=np.int64)
+        for row, i in enumerate(positions):
+            seq = tokenized_comments_ids[i]
+            inputs[row, :len(seq)] = seq
+            masks[row, :len(seq)] = 1
+        yield positions, inputs, masks
+
+
+def camembert_logits(comments: list, size: int = batch_size, backend: str = 'camembert') -> np.array:
+    """
+    get the logits of camemBERT for comments
+    :param comments: list: 'titre comment' of every review
+    :param size: int: number of reviews per mini-batch
+    :param backend: str: 'camembert' (torch), 'camembert_onnx' or 'camembert_int8' (onnxruntime, without torch)
+    :return: np.array: logits (number of comments, 2)
+    """
+    # camemBERT and its tokenizer
+    model, tokenizer = registry.get(backend)
+    if backend == 'camembert':
+        import torch
+        device = get_device()
+
+    # Encode the comments, truncated to MAX_LEN tokens
+    tokenized_comments_ids = [tokenizer.encode(comment, add_special_tokens=True,
+                                               max_length=MAX_LEN, truncation=True) for comment in comments]
+
+    logits = np.zeros((len(comments), 2), dtype="float32")
+    for positions, inputs, masks in bucket_batches(tokenized_comments_ids, size):
+        metrics.BATCH_SIZE.labels(backend).observe(len(positions))
+        if backend == 'camembert':
+            # Forward pass, calculate logit predictions
+            with torch.no_grad():
+                outputs = model(torch.from_numpy(inputs).to(device), token_type_ids=None,
+                                attention_mask=torch.from_numpy(masks).to(device))
+            logits[positions] = outputs[0].cpu().numpy()
+        else:
+            logits[positions] = model.run(['logits'], {'input_ids': inputs, 'attention_mask': masks})[0]
+    return logits
+
+
+def predict_comments(comments: list, size: int = batch_size, backend: str = 'camembert') -> list:
+    """
+    predict the sentiment of comments with camemBERT
+    :param comments: list: 'titre comment' of every review
+    :param size: int: number of reviews per mini-batch
+    :param backend: str: 'camembert' (torch), 'camembert_onnx' or 'camembert_int8' (onnxruntime)
+    :return: list: sentiment of every review
+    """
+    init_time = datetime.now()
+    predictions = np.argmax(camembert_logits(comments, size, backend), axis=1)
+
+    time_elapsed = (datetime.now() - init_time).total_seconds()
+    if time_elapsed > 0:
+        print(f'CamemBERT ({backend}) : {len(comments)} reviews in {time_elapsed:.2f}s '
+              f'({len(comments) / time_elapsed:.1f} reviews/s, batch size {size})')
+    return predictions.tolist()
+
+
+def predict_camembert(df: pd.DataFrame, size: int = batch_size, backend: str = 'camembert') -> pd.DataFrame:
     """
     predict the sentiment of reviews
     :param df: dataframe with reviews
+    :param size: int: number of reviews per mini-batch
+    :param backend: str: 'camembert' (torch), 'camembert_onnx' or 'camembert_int8' (onnxruntime)
     :return: dataframe: dataframe with prediction of reviews
     """
     df['space'] = ' '
     df['comments'] = df[['titre', 'space', 'comment']].fillna('').sum(axis=1)
     df = df.dropna(subset=['comments'], axis="rows")
     comments = df['comments'].to_list()
-    # camemBERT
-    state_dict = torch.load("camemBERT_38000_state_dict.pt", map_location=torch.device('cpu'))
-    model = CamembertForSequenceClassification.from_pretrained('camembert-base', num_labels=2, state_dict=state_dict)
-
-    # Initialize CamemBERT tokenizer
-    tokenizer = CamembertTokenizer.from_pretrained('camembert-base', do_lower_case=True)
-
-    # Encode the comments
-    tokenized_comments_ids = [tokenizer.encode(comment,
-                                               add_special_tokens=True, max_length=MAX_LEN) for comment in comments]
-    # Pad the resulted encoded comments
-    tokenized_comments_ids = pad_sequences(tokenized_comments_ids, maxlen=MAX_LEN, dtype="long",
-                                           truncating="post", padding="post")
-
-    # Create attention masks
-    attention_masks = []
-    for seq in tokenized_comments_ids:
-        seq_mask = [float(i > 0) for i in seq]
-        attention_masks.append(seq_mask)
-
-    prediction_inputs = torch.tensor(tokenized_comments_ids)
-    prediction_masks = torch.tensor(attention_masks)
-
-    predictions = []
-    with torch.no_grad():
-        # Forward pass, calculate logit predictions
-        outputs = model(prediction_inputs.to(device), token_type_ids=None,
-                         attention_mask=prediction_masks.to(device))
-        logits = outputs[0]
-        logits = logits.detach().cpu().numpy()
-        predictions.extend(np.argmax(logits, axis=1).flatten())
+    predictions = cached_predictions([backend], comments,
+                                     lambda positions: predict_comments([comments[i] for i in positions], size,
+                                                                        backend))
 
     df = pd.DataFrame(data={"site": df["site"], "date": df["date"],
                             "review": df["review"], "sentiment": predictions})
@@ -0,0 +1,170 @@
+import os
+import re
+import json
+import pandas as pd
+from bs4 import BeautifulSoup, SoupStrainer
+
+# backend used to parse trustpilot pages: 'lxml' (default), 'selectolax' or 'html.parser'
+PARSER = os.environ.get('HTML_PARSER', 'lxml')
+BACKENDS = ['lxml', 'selectolax', 'html.parser']
+
+
+def _classes(attrs: dict) -> list:
+    # class attribute is still a string while the page is parsed, a list once the tag is built
+    classes = attrs.get('class') or []
+    return classes.split() if isinstance(classes, str) else classes
+
+
+def _tag_data(name, attrs: dict) -> tuple:
+    # SoupStrainer gives name and attributes while parsing, a built tag otherwise
+    if attrs is None:
+        return getattr(name, 'name', None), getattr(name, 'attrs', {})
+    return name, attrs
+
+
+def _review_blocks(name, attrs: dict = None) -> bool:
+    # keep only review blocks and the link to next page when parsing with a SoupStrainer
+    name, attrs = _tag_data(name, attrs)
+    classes = _classes(attrs)
+    return (name == 'div' and 'review-content' in classes) or (name == 'a' and 'next-page' in classes)
+
+
+def _category_blocks(name, attrs: dict = None) -> bool:
+    name, attrs = _tag_data(name, attrs)
+    return ((name == 'div' and 'styles_businessTitle__1IANo' in _classes(attrs))
+            or (name == 'a' and attrs.get('name') == 'pagination-button-next'))
+
+
+def _search_blocks(name, attrs: dict = None) -> bool:
+    name, attrs = _tag_data(name, attrs)
+    return name == 'a' and 'search-result-heading' in _classes(attrs)
+
+
+def published_date(dates: str) -> str:
+    """
+    read the publishedDate in the json of review dates
+    :param dates: str: json script of review dates, or html of the dates block
+    :return: str: publishedDate
+    """
+    try:
+        return json.loads(dates)['publishedDate']
+    except (ValueError, KeyError, TypeError):
+        return re.search('"publishedDate":"(.*)","updatedDate', dates).group(1)
+
+
+def parse_dates(dates: pd.Series) -> pd.Series:
+    """
+    parse publishedDate of reviews once, reviews without date give NaT
+    :param dates: series of str: publishedDate
+    :return: series of datetime64
+    """
+    return pd.to_datetime(dates.astype(str).str[:19], format='%Y-%m-%dT%H:%M:%S', errors='coerce')
+
+
+def _soup(content: bytes, backend: str, strainer) -> BeautifulSoup:
+    if backend == 'html.parser':
+        return BeautifulSoup(content, 'html.parser')
+    return BeautifulSoup(content, 'lxml', parse_only=SoupStrainer(strainer))
+
+
+def _selectolax(content: bytes):
+    # optional dependency, only needed for the selectolax backend
+    from selectolax.parser import HTMLParser
+    return HTMLParser(content)
+
+
+def parse_review_page(content: bytes, site: str, backend: str = PARSER) -> tuple:
+    """
+    get infos for every review of a trustpilot review page
+    :param content: bytes: html of the page
+    :param site: str: site of the reviews
+    :param backend: str: 'lxml', 'selectolax' or 'html.parser'
+    :return: tuple: list of [site, note, titre, comment, date] per review, True if there is a next page
+    """
+    infos = []
+    if backend == 'selectolax':
+        tree = _selectolax(content)
+        for opinion in tree.css('div.review-content'):
+            info = [site]
+
+            # get number of stars
+            img = opinion.css_first('div.star-rating.star-rating--medium img')
+            if img:
+                info.append(img.attributes.get('alt'))
+
+            # get title
+            title = opinion.css_first('h2.review-content__title')
+            if title:
+                info.append(title.text().strip())
+
+            # get review content
+            content_tag = opinion.css_first('p.review-content__text')
+            info.append(content_tag.text().strip() if content_tag else '')
+
+            # get date of post
+            date_of_post = opinion.css_first('div.review-content-header__dates')
+            if date_of_post:
+                script = date_of_post.css_first('script')
+                info.append(published_date(script.text() if script else date_of_post.html))
+            infos.append(info)
+        return infos, tree.css_first('a.button.button--primary.next-page') is not None
+
+    soup = _soup(content, backend, _review_blocks)
+    for opinion in soup.find_all(["div"], attrs={"class": "review-content"}):
+        info = [site]
+
+        # get number of stars
+        star = opinion.find(["div"], attrs={"class": "star-rating star-rating--medium"})
+        img = star.find('img') if star else None
+        if img:
+            info.append(img['alt'])
+
+        # get title
+        title = opinion.find('h2', attrs={'class': 'review-content__title'})
+        if title:
+            info.append(title.text.strip())
+
+        # get review content
+        content_tag = opinion.find(["p"], attrs={"class": "review-content__text"})
+        info.append(content_tag.text.strip() if content_tag else '')
+
+        # get date of post
+        date_of_post = opinion.find(['div'], attrs={"class": 'review-content-header__dates'})
+        if date_of_post:
+            script = date_of_post.find('script')
+            info.append(published_date(script.string if script and script.string else str(date_of_post)))
+        infos.append(info)
+
+    # check if there is a page after the current one
+    tag = soup.find(["a"], attrs={"class": "button button--primary next-page"})
+    return infos, tag is not None
+
+
+def parse_category_page(content: bytes, backend: str = PARSER) -> tuple:
+    """
+    get site names of a trustpilot category page
+    :param content: bytes: html of the page
+    :param backend: str: 'lxml', 'selectolax' or 'html.parser'
+    :return: tuple: list of site names, True if there is a next page
+    """
+    if backend == 'selectolax':
+        tree = _selectolax(content)
+        sites = [site.text().strip() for site in tree.css('div.styles_businessTitle__1IANo')]
+        return sites, tree.css_first('a[name="pagination-button-next"]') is not None
+
+    soup = _soup(content, backend, _category_blocks)
+    sites = [site.text.strip() for site in soup.find_all(["div"], attrs={"class": "styles_businessTitle__1IANo"})]
+    return sites, soup.find(["a"], attrs={"name": "pagination-button-next"}) is not None
+
+
+def parse_search_page(content: bytes, backend: str = PARSER) -> list:
+    """
+    get results of a trustpilot search page
+    :param content: bytes: html of the page
+    :param backend: str: 'lxml', 'selectolax' or 'html.parser'
+    :return: list: 'name | site' of every result
+    """
+    if backend == 'selectolax':
+        return [result.text() for result in _selectolax(content).css('a.search-result-heading')]
+    soup = _soup(content, backend, _search_blocks)
+    return [result.text for result in soup.find_all(["a"], attrs={"class": "search-result-heading"})]
@@ -0,0 +1,198 @@
+import os
+from datetime import datetime
+import pandas as pd
+
+# importation of linked python file
+import scraping
+import process
+import model
+import metrics
+import review_store
+
+# steps of an analysis, in order
+STAGES = ['scraping', 'preprocess', 'prediction', 'postprocess']
+# number of sites analysed together by analyse_stream
+STREAM_GROUP_SIZE = int(os.environ.get('STREAM_GROUP_SIZE', 2))
+
+
+def get_params(args) -> dict:
+    """
+    read and normalize the parameters of an analysis
+    :param args: dict-like: query parameters
+    :return: dict: category, num_of_site, num_page, location, incremental, model, windows
+    """
+    # Mandatory argument : Category
+    category = args.get('category')
+
+    # Optional argument
+    # number of site to scrape per category, default 5 (0 for max)
+    if args.get('num_of_site'):
+        num_of_site = int(args.get('num_of_site'))
+    else:
+        num_of_site = 5
+    # number of page to scrape per site, default 2 (0 for max)
+    if args.get('num_page'):
+        num_page = int(args.get('num_page'))
+    else:
+        num_page = 2
+    # city where the scraping is desired (better with department number)
+    if args.get('location'):
+        location = str(args.get('location'))
+    else:
+        location = 'no city'
+    # scrape only reviews published since last scraping and reuse stored reviews
+    incremental = str(args.get('incremental', '')) not in ('', '0', 'false')
+    # model to use for prediction: a camemBERT backend ('camembert', 'camembert_onnx' or 'camembert_int8'),
+    # 'camembert' for any other value, else default model
+    model_to_test = 'default'
+    if args.get('model'):
+        model_to_test = args.get('model') if args.get('model') in model.CAMEMBERT_BACKENDS else 'camembert'
+    # time windows summarized in addition to the last 3 months, as '7d,30d,365d' (days) or '6m' (months)
+    windows = process.SUMMARY_WINDOWS
+    if args.get('windows'):
+        windows = [window for window in str(args.get('windows')).split(',') if process.WINDOW_PATTERN.match(window)]
+
+    return {
+        'category': category,
+        'num_of_site': num_of_site,
+        'num_page': num_page,
+        'location': location,
+        'incremental': incremental,
+        'model': model_to_test,
+        'windows': windows
+    }
+
+
+def predict(df: pd.DataFrame, model_to_test: str) -> pd.DataFrame:
+    """
+    predict sentiment of preprocessed reviews with the chosen model
+    :param df: dataframe with preprocessed reviews
+    :param model_to_test: str: a camemBERT backend or 'default'
+    :return: dataframe: site, date, review and sentiment of every review
+    """
+    if model_to_test in model.CAMEMBERT_BACKENDS:
+        predicted = model.predict_camembert(df, backend=model_to_test)
+    else:
+        predicted = model.predict(df)
+    # dates parsed at scraping
+    if 'published' in df.columns:
+        predicted['published'] = df.loc[predicted.index, 'published']
+    return predicted
+
+
+def store(category: str, df: pd.DataFrame, predicted: pd.DataFrame, model_to_test: str):
+    """
+    keep analysed reviews in the review store, an error is printed and does not stop the analysis
+    :param category: str: category of the sites
+    :param df: dataframe with preprocessed reviews
+    :param predicted: dataframe from predict
+    :param model_to_test: str: model used for prediction
+    """
+    try:
+        review_store.save(category, df, predicted, model_to_test)
+    except Exception as error:
+        print(f'Reviews not stored : {error!r}')
+
+
+def analyse(params: dict, progress=None):
+    """
+    scrape, preprocess, predict and postprocess reviews of a category
+    :param params: dict: parameters from get_params
+    :param progress: function called with the name of a stage and 'running', then 'done' or 'error'
+    :return: json file, or html message if no review is found
+    """
+    initial_time = datetime.now()
+    print('\n', '#'*50)
+    print(f' Start Analyse on {params["category"]} '.center(50, '#'))
+    print('#'*50, '\n')
+
+    # 2. Scrape trustpilot to get dataframe
+    with metrics.stage('scraping', progress):
+        refs, df = scraping.scrape(params['category'], params['location'], params['num_of_site'],
+                                   params['num_page'], params['incremental'])
+    metrics.REVIEWS.labels('scraping').inc(len(df))
+    if len(df)>0:
+        # 3. Preprocess dataframe before prediction
+        with metrics.stage('preprocess', progress):
+            cache_stats = process.preprocess_cache.stats()
+            df = process.preprocess_df(df)
+        print(f"Preprocess cache : {process.preprocess_cache.hits - cache_stats['hits']} hits, "
+              f"{process.preprocess_cache.misses - cache_stats['misses']} misses")
+
+        # 4. Predict sentiment and add it to dataframe, analysed reviews are kept in the review store
+        with metrics.stage('prediction', progress):
+            predicted = predict(df, params['model'])
+        store(params['category'], df, predicted, params['model'])
+        df = predicted
+        metrics.REVIEWS.labels('prediction').inc(len(df))
+
+        # 5. Apply postprocess to transform data into json
+        with metrics.stage('postprocess', progress):
+            json_review = process.postprocess(df, refs, params['windows'])
+    else:
+        print("No data found")
+        json_review = "<h1>Pas de données</h1>"
+    time_elapsed = datetime.now() - initial_time
+    metrics.STAGE_SECONDS.labels('total').observe(time_elapsed.total_seconds())
+    print(f'Total time elapsed : {time_elapsed}')
+    return json_review
+
+
+def analyse_stream(params: dict, group_size: int = STREAM_GROUP_SIZE):
+    """
+    same analysis as analyse, sites are scraped, preprocessed and predicted by groups
+    and the details of each site are given as soon as its group is analysed
+    the summary given at the end needs every review (word clouds are tfidf of all reviews), so predicted reviews
+    of every group are kept until the end: peak memory is close to analyse, only texts are not kept
+    :param params: dict: parameters from get_params
+    :param group_size: int: number of sites analysed together
+    :return: generator of {'details': {site: details}}, then {'summary': summary},
+    {'last_3_month': summary} and {'windows': {window: summary}}, or {'error': message} if no review is found
+    """
+    initial_time = datetime.now()
+    print(f' Start streamed analyse on {params["category"]} '.center(50, '#'))
+    with metrics.stage('scraping'):
+        refs = scraping.scrape_category(params['category'], params['location'], params['num_of_site'])
+
+    analysed = []
+    for start in range(0, len(refs[1]), group_size):
+        init_time = datetime.now()
+        sites = refs[1][start:start + group_size]
+        with metrics.stage('scraping'):
+            df = scraping.scrape_site(sites, params['num_page'], incremental=params['incremental'])
+        metrics.REVIEWS.labels('scraping').inc(len(df))
+        if len(df) == 0:
+            continue
+        with metrics.stage('preprocess'):
+            df = process.preprocess_df(df)
+        with metrics.stage('prediction'):
+            predicted = predict(df, params['model'])
+        store(params['category'], df, predicted, params['model'])
+        df = predicted.reset_index(drop=True)
+        metrics.REVIEWS.labels('prediction').inc(len(df))
+        with metrics.stage('postprocess'):
+            details = process.get_details(df, process.WordCloudEngine(df))
+        for site, detail in details.items():
+            yield {'details': {site: detail}}
+        analysed.append(df)
+        print(f'Sites {", ".join(sites)} analysed in {datetime.now() - init_time}')
+
+    if not analysed:
+        print("No data found")
+        yield {'error': 'Pas de données'}
+        return
+
+    with metrics.stage('postprocess'):
+        df = pd.concat(analysed, ignore_index=True)
+        engine = process.WordCloudEngine(df)
+        time_index = process.TimeIndex(df)
+        summary = process.get_summary(df, refs, engine)
+        last_month = process.get_last_month(df, engine, time_index)
+        windows = {window: process.get_window(df, window, engine, time_index) for window in params['windows']}
+    yield {'summary': summary}
+    yield {'last_3_month': last_month}
+    if params['windows']:
+        yield {'windows': windows}
+    time_elapsed = datetime.now() - initial_time
+    metrics.STAGE_SECONDS.labels('total').observe(time_elapsed.total_seconds())
+    print(f'Total time elapsed : {time_elapsed}')
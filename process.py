@@ -1,25 +1,23 @@
+import os
 import pandas as pd
 import re
 import numpy as np
 # import nltk
 
 # nltk.download('punkt')
-from nltk import word_tokenize
-from nltk.corpus import stopwords
-
 # nltk.download('stopwords')
 # nltk.download('wordnet')
-import spacy
-from spacy_lefff import LefffLemmatizer
-from spacy.language import Language
 import json
-from collections import Counter
-from datetime import datetime
+from functools import lru_cache
+from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from gensim.models import Phrases
-from spacy.lang.fr.stop_words import STOP_WORDS as fr_stop
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.feature_extraction.text import TfidfTransformer
+from scipy.sparse import csr_matrix
+
+import cache
+import parsers
+import registry
+
+# nltk, spaCy, gensim and scikit-learn are imported on first use, so that the api starts without them
 
 # regex to keep letters (also with accent) and emojis
 EMOJI_PATTERN = re.compile(
@@ -40,21 +38,59 @@ EMOJI_PATTERN = re.compile(
     "]+"
 )
 
-stop_words = stopwords.words("french")
 new_stop_words = ['avoir', 'être', 'dire', 'donc', 'si', 'livraison', 'livrer', 'car', 'command', 'commande',
                   'commander']
-stop_words.extend(new_stop_words)
-stop_words = set.union(fr_stop, set(stop_words))
 
-try:
-    @Language.factory('french_lemmatizer')
-    def create_french_lemmatizer(nlp, name):
-        return LefffLemmatizer()
-except:
-    print('already exist')
 
-nlp = spacy.load('fr_core_news_sm')
-nlp.add_pipe('french_lemmatizer', name='lefff')
+@lru_cache(maxsize=None)
+def get_stop_words() -> set:
+    """
+    french stop words of nltk and spaCy, read once
+    """
+    from nltk.corpus import stopwords
+    from spacy.lang.fr.stop_words import STOP_WORDS as fr_stop
+    stop_words = stopwords.words("french")
+    stop_words.extend(new_stop_words)
+    return set.union(fr_stop, set(stop_words))
+
+
+def load_nlp():
+    # spaCy french pipeline with Lefff lemmatizer
+    import spacy
+    from spacy_lefff import LefffLemmatizer
+    from spacy.language import Language
+    try:
+        @Language.factory('french_lemmatizer')
+        def create_french_lemmatizer(nlp, name):
+            return LefffLemmatizer()
+    except:
+        print('already exist')
+
+    nlp = spacy.load('fr_core_news_sm')
+    nlp.add_pipe('french_lemmatizer', name='lefff')
+    return nlp
+
+
+registry.register('spacy', load_nlp)
+
+
+def get_nlp():
+    """
+    get the spaCy pipeline, loaded on first use or with registry.preload(['spacy'])
+    """
+    return registry.get('spacy')
+
+# number of reviews per nlp.pipe batch and number of spaCy worker processes for bulk preprocessing
+PIPE_BATCH_SIZE = int(os.environ.get('PREPROCESS_BATCH_SIZE', 256))
+PIPE_N_PROCESS = int(os.environ.get('PREPROCESS_N_PROCESS', 1))
+
+# preprocessed reviews by hash of 'titre comment'
+preprocess_cache = cache.Cache('preprocess')
+
+# time windows summarized by postprocess in addition to the last 3 months, number of days ('7d') or months ('3m')
+WINDOW_PATTERN = re.compile(r'^[0-9]+[dm]$')
+SUMMARY_WINDOWS = [window for window in os.environ.get('SUMMARY_WINDOWS', '').split(',')
+                   if WINDOW_PATTERN.match(window)]
 
 
 def clean_txt(txt: str) -> str:
@@ -83,38 +119,62 @@ def remove_stop_words(txt: list) -> list:
     Return
         txt -> list : list of strings without stop words
     """
+    stop_words = get_stop_words()
     txt = [x for x in txt if x not in stop_words]
     return txt
 
 
-def lemmatization(txt: list) -> list:
-    txt = ' '.join(txt)
+def lemmas(doc) -> list:
+    """
+    get lemmas of the tokens of a spaCy doc which are not stop words
+    """
+    stop_words = get_stop_words()
     lemmatized_list = []
-    txt = nlp(txt)
-    for t in txt:
+    for t in doc:
         if t.text not in stop_words:
             lemmatized_list.append(t.lemma_)
     return lemmatized_list
 
 
-def preprocess(txt: str) -> list:
+def lemmatization(txt: list) -> list:
+    txt = ' '.join(txt)
+    return lemmas(get_nlp()(txt))
+
+
+def tokenize(txt: str) -> list:
     """
-    Cleans, tokenizes, lemmatize text and remove stop words
+    Cleans, tokenizes text and remove stop words before lemmatization
     Params:
-        txt -> str: Text to preprocess
+        txt -> str: Text to tokenize
     Return:
-        lemmas -> list: Preprocessed text
+        tokens -> list: list of words
     """
 
     # 1. Clean text
     cleaned_txt = clean_txt(txt)
 
     # 2. Split into individual words
+    from nltk import word_tokenize
     cleaned_txt = word_tokenize(cleaned_txt)
 
     # 3. Remove stopwords
     cleaned_txt = remove_stop_words(cleaned_txt)
 
+    return cleaned_txt
+
+
+def preprocess(txt: str) -> list:
+    """
+    Cleans, tokenizes, lemmatize text and remove stop words
+    Params:
+        txt -> str: Text to preprocess
+    Return:
+        lemmas -> list: Preprocessed text
+    """
+
+    # 1-3. Clean, tokenize text and remove stopwords
+    cleaned_txt = tokenize(txt)
+
     # 4. Lemmatization
     cleaned_txt = lemmatization(cleaned_txt)
 
@@ -124,59 +184,174 @@ def preprocess(txt: str) -> list:
     return cleaned_txt
 
 
+def preprocess_bulk(texts: list, batch_size: int = PIPE_BATCH_SIZE, n_process: int = PIPE_N_PROCESS) -> list:
+    """
+    same as preprocess for a list of texts, lemmatized in batches with nlp.pipe
+    Params:
+        texts -> list: Texts to preprocess
+        batch_size -> int: number of texts per spaCy batch
+        n_process -> int: number of spaCy worker processes
+    Return:
+        lemmas -> list: list of preprocessed texts
+    """
+    # 1-3. Clean, tokenize text and remove stopwords
+    joined_txts = [' '.join(tokenize(txt)) for txt in texts]
+
+    # 4. Lemmatization, parser and named entities are not needed for lemmas
+    nlp = get_nlp()
+    disable = [name for name in ('parser', 'ner') if name in nlp.pipe_names]
+    docs = nlp.pipe(joined_txts, batch_size=batch_size, n_process=n_process, disable=disable)
+
+    # 5. Remove stopwords
+    return [remove_stop_words(lemmas(doc)) for doc in docs]
+
+
+def preprocess_cached(texts: list) -> list:
+    """
+    same as preprocess_bulk, only texts not found in preprocess_cache are preprocessed
+    Params:
+        texts -> list: Texts to preprocess
+    Return:
+        lemmas -> list: list of preprocessed texts
+    """
+    keys = [cache.text_key(txt) for txt in texts]
+    cached = preprocess_cache.get_many(keys)
+
+    # preprocess texts missing from cache, once per distinct text
+    missing = {key: txt for key, txt in zip(keys, texts) if key not in cached}
+    if missing:
+        preprocessed = dict(zip(missing, preprocess_bulk(list(missing.values()))))
+        preprocess_cache.set_many(preprocessed)
+        cached.update(preprocessed)
+
+    return [cached[key] for key in keys]
+
+
 def preprocess_df(df):
+    from gensim.models import Phrases
     df['space'] = ' '
     df['review'] = df[['titre', 'space', 'comment']].fillna('').sum(axis=1)
-    df['review'] = df['review'].apply(preprocess)
+    df['review'] = preprocess_cached(df['review'].to_list())
     bigram_transformer = Phrases(df['review'])
     df['review'] = bigram_transformer[df['review']]
     return df
 
 
-def get_word_cloud(df: pd.DataFrame, nb_of_words=30) -> dict:
+@lru_cache(maxsize=100000)
+def normalize_word(word: str) -> str:
     """
-    get number of occurence for 'nb_of_words' most common words
-    :param df: dataframe
-    :param nb_of_words: number of words to show
-    :return: dict: dictionary of top words with nb of occurence
+    clean_txt memoized for words, reviews share most of their words
     """
-    reviews = []
-    word_cloud = {}
-    if len(df) > 0:
-        df = df.dropna(subset=['review'], axis="rows")
-        df['review2'] = df['review'].map(clean_txt)
-        for li in df['review2']:
-            reviews.append(li)
+    return clean_txt(word)
+
 
-        cvec = CountVectorizer(stop_words=stop_words, min_df=1, max_df=1.0, ngram_range=(1, 2))
-        sf = cvec.fit_transform(reviews)
+def count_words(reviews: pd.Series) -> tuple:
+    """
+    count cleaned words of every review without building the list of every word,
+    counts of a group of reviews are the sum of their rows
+    :param reviews: series of list of words
+    :return: tuple: id per cleaned word, sparse matrix of number of occurrence (reviews, words)
+    """
+    word_ids = {}
+    ids = []
+    indptr = [0]
+    for review in reviews:
+        ids.extend(word_ids.setdefault(normalize_word(word), len(word_ids)) for word in review)
+        indptr.append(len(ids))
+    word_counts = csr_matrix((np.ones(len(ids), dtype=np.int64), np.array(ids, dtype=int), indptr),
+                             shape=(len(indptr) - 1, len(word_ids)))
+    return word_ids, word_counts
+
+
+class WordCloudEngine:
+    """
+    vocabulary and document-term matrix fitted once on every review of a request,
+    word clouds of slices of the reviews are computed from rows of the shared matrix
+    """
 
+    def __init__(self, df: pd.DataFrame):
+        """
+        :param df: dataframe with every review, with an index unique for every review
+        """
+        df = df.dropna(subset=['review'], axis="rows")
+        self.index = df.index
+
+        # cleaned words of every review counted once, counts of a slice are sums of rows
+        self.word_ids, self.word_counts = count_words(df['review'])
+
+        from sklearn.feature_extraction.text import CountVectorizer
+        cvec = CountVectorizer(stop_words=get_stop_words(), min_df=1, max_df=1.0, ngram_range=(1, 2))
+        try:
+            self.matrix = cvec.fit_transform(df['review'].map(clean_txt)).tocsr()
+            self.terms = np.array(cvec.get_feature_names(), dtype=object)
+        except ValueError:
+            # no word left once stop words are removed
+            self.matrix = None
+
+    def word_cloud(self, df: pd.DataFrame, nb_of_words=30) -> dict:
+        """
+        get number of occurence for 'nb_of_words' most common words of a slice of the reviews,
+        same result as a tfidf fitted on the slice only
+        :param df: dataframe: slice of the dataframe used to build the engine
+        :param nb_of_words: number of words to show
+        :return: dict: dictionary of top words with nb of occurence
+        """
+        word_cloud = {}
+        rows = self.index.get_indexer(df.index)
+        rows = rows[rows >= 0]
+        if self.matrix is None or len(rows) == 0:
+            return word_cloud
+
+        # keep the terms used in the slice, in vocabulary order as a vectorizer fitted on the slice
+        sf = self.matrix[rows]
+        columns = np.flatnonzero(sf.getnnz(axis=0))
+        sf = sf[:, columns]
+        sf.sort_indices()
+
+        from sklearn.feature_extraction.text import TfidfTransformer
         transformer = TfidfTransformer()
         transformed_weights = transformer.fit_transform(sf)
         weights = np.asarray(transformed_weights.mean(axis=0)).ravel().tolist()
-        weights_df = pd.DataFrame({'term': cvec.get_feature_names(), 'weight': weights})
+        weights_df = pd.DataFrame({'term': self.terms[columns], 'weight': weights})
         tfidf = weights_df.sort_values(by='weight', ascending=False).head(nb_of_words)
-        if len(df) > 0:
-            list_of_words = df['review'].sum(axis=0)
-            word_list = []
-            for word in list_of_words:
-                word = clean_txt(word)
-                word_list.append(word)
-
-            count_pos = Counter(word_list)
-            word_cloud_tuples = count_pos.most_common()
-
-            for _, row in tfidf.iterrows():
-                for elt in word_cloud_tuples:
-                    if elt[0] == row.term:
-                        word_cloud[elt[0]] = {
-                            'tfidf': row.weight,
-                            'nb_occurrence': elt[1]
-                        }
-    return word_cloud
-
-
-def get_summary(df, refs='last_month'):
+
+        count_pos = np.asarray(self.word_counts[rows].sum(axis=0)).ravel()
+
+        for term, weight in zip(tfidf['term'], tfidf['weight'].tolist()):
+            word_id = self.word_ids.get(term)
+            if word_id is not None and count_pos[word_id] > 0:
+                word_cloud[term] = {
+                    'tfidf': weight,
+                    'nb_occurrence': int(count_pos[word_id])
+                }
+        return word_cloud
+
+
+def get_word_cloud(df: pd.DataFrame, nb_of_words=30, engine: WordCloudEngine = None) -> dict:
+    """
+    get number of occurence for 'nb_of_words' most common words
+    :param df: dataframe
+    :param nb_of_words: number of words to show
+    :param engine: WordCloudEngine: engine fitted on a dataframe df is a slice of (fitted on df if None)
+    :return: dict: dictionary of top words with nb of occurence
+    """
+    if len(df) == 0:
+        return {}
+    if engine is None:
+        engine = WordCloudEngine(df)
+    return engine.word_cloud(df, nb_of_words)
+
+
+def get_summary(df, refs='last_month', engine: WordCloudEngine = None):
+    """
+    get number of reviews and word clouds per sentiment
+    :param df: dataframe
+    :param refs: list: refs from scraping.scrape_category, 'last_month' for a summary without numbers of sites
+    nb_concurent is the number of sites found on the category pages read, which stop being read
+    once num_of_site sites are found (all sites of the category only with num_of_site=0)
+    :param engine: WordCloudEngine: engine fitted on a dataframe df is a slice of (fitted on df if None)
+    :return: dict: summary
+    """
     df_pos = df[df['sentiment'] == 1]
     df_neg = df[df['sentiment'] == 0]
     summary = {
@@ -186,8 +361,8 @@ def get_summary(df, refs='last_month'):
                 'neg': len(df_neg)
             },
             'word_cloud': {
-                'pos': get_word_cloud(df_pos),
-                'neg': get_word_cloud(df_neg)
+                'pos': get_word_cloud(df_pos, engine=engine),
+                'neg': get_word_cloud(df_neg, engine=engine)
             }
         }
 
@@ -198,48 +373,107 @@ def get_summary(df, refs='last_month'):
     return summary
 
 
-def get_details(df: pd.DataFrame) -> json:
+def get_details(df: pd.DataFrame, engine: WordCloudEngine = None) -> json:
     """
     get details from scraped sites
     :param df: full dataframe
+    :param engine: WordCloudEngine: engine fitted on df
     :return: json file
     """
     detail = {}
+    # number of reviews per site and reviews per (site, sentiment), computed in one pass
+    site_sizes = df.groupby('site', sort=False).size()
+    partitions = dict(iter(df.groupby(['site', 'sentiment'], sort=False)))
+    empty = df.iloc[:0]
     for site in df['site'].unique():
+        df_pos = partitions.get((site, 1), empty)
+        df_neg = partitions.get((site, 0), empty)
         detail[site] = {
-            'nb_review_analysed': len(df[df['site'] == site]),
+            'nb_review_analysed': int(site_sizes.get(site, 0)),
             'nb_review': {
-                'pos': len(df[(df['site'] == site) & (df['sentiment'] == 1)]),
-                'neg': len(df[(df['site'] == site) & (df['sentiment'] == 0)])
+                'pos': len(df_pos),
+                'neg': len(df_neg)
             },
             'word_cloud': {
-                'pos': get_word_cloud(df[(df['site'] == site) & (df['sentiment'] == 1)]),
-                'neg': get_word_cloud(df[(df['site'] == site) & (df['sentiment'] == 0)])
+                'pos': get_word_cloud(df_pos, engine=engine),
+                'neg': get_word_cloud(df_neg, engine=engine)
             }
         }
 
     return detail
 
 
-def get_last_month(df: pd.DataFrame) -> json:
-    df['date'] = df['date'].str[:19]
-    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%dT%H:%M:%S')
-    df = df[df['date'] >= (datetime.now() - relativedelta(months=+3))]
-    last_month = get_summary(df)
-    return last_month
+class TimeIndex:
+    """
+    reviews sorted once by publication date, reviews of a time window are found by binary search
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        """
+        :param df: dataframe with a 'published' column (parsed from 'date' if missing, df is not modified)
+        """
+        published = df['published'] if 'published' in df.columns else parsers.parse_dates(df['date'])
+        published = published.dropna()
+        order = np.argsort(published.values, kind='stable')
+        self.dates = published.values[order]
+        self.index = published.index[order]
+
+    def since(self, start: datetime) -> pd.Index:
+        """
+        :param start: datetime: start of the time window
+        :return: Index: index of the reviews published since start, in the order of the dataframe
+        """
+        position = np.searchsorted(self.dates, np.datetime64(start), side='left')
+        return self.index[position:].sort_values()
+
+
+def window_start(window: str) -> datetime:
+    """
+    :param window: str: time window, number of days ('7d') or months ('3m')
+    :return: datetime: start of the time window
+    """
+    number, unit = int(window[:-1]), window[-1]
+    if unit == 'm':
+        return datetime.now() - relativedelta(months=number)
+    return datetime.now() - timedelta(days=number)
+
+
+def get_window(df: pd.DataFrame, window: str, engine: WordCloudEngine = None, time_index: TimeIndex = None) -> dict:
+    """
+    get summary of the reviews published during a time window
+    :param df: full dataframe
+    :param window: str: time window, number of days ('7d') or months ('3m')
+    :param engine: WordCloudEngine: engine fitted on df
+    :param time_index: TimeIndex: time index of df (built if None)
+    :return: dict: summary of the window
+    """
+    if time_index is None:
+        time_index = TimeIndex(df)
+    return get_summary(df.loc[time_index.since(window_start(window))], engine=engine)
+
+
+def get_last_month(df: pd.DataFrame, engine: WordCloudEngine = None, time_index: TimeIndex = None) -> json:
+    return get_window(df, '3m', engine, time_index)
 
 
-def postprocess(df: pd.DataFrame, refs: list) -> json:
+def postprocess(df: pd.DataFrame, refs: list, windows: list = SUMMARY_WINDOWS) -> json:
     """
     analyse dataframe to obtain json file
     :param df: full dataframe
     :param refs: list: total list of sites, scraped sites
+    :param windows: list: time windows summarized in 'windows', as '7d' or '3m'
     :return: json file
     """
+    # vocabulary, tfidf matrix, word counts and dates sorted once for every word cloud and time window
+    df = df.reset_index(drop=True)
+    engine = WordCloudEngine(df)
+    time_index = TimeIndex(df)
     json_review = {
-        'summary': get_summary(df, refs),
-        'details': get_details(df),
-        'last_3_month': get_last_month(df)
+        'summary': get_summary(df, refs, engine),
+        'details': get_details(df, engine),
+        'last_3_month': get_last_month(df, engine, time_index)
     }
+    if windows:
+        json_review['windows'] = {window: get_window(df, window, engine, time_index) for window in windows}
     return json_review
 
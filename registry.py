@@ -0,0 +1,192 @@
+import os
+import sys
+import glob
+import hashlib
+import threading
+import time
+import resource
+
+# registered loaders, loaded models and their loading stats, shared across requests
+_loaders = {}
+_models = {}
+_stats = {}
+_locks = {}
+# version of weight files that could not be loaded, not tried again until the files change
+_failed_versions = {}
+_registry_lock = threading.Lock()
+
+
+def rss_mb() -> float:
+    """
+    get current resident memory of the process
+    :return: float: resident memory in MB
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        # no procfs (macOS): fall back on peak memory, given in bytes on macOS and in KB elsewhere
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / 1024 ** 2 if sys.platform == 'darwin' else max_rss / 1024
+
+
+def memory_usage() -> dict:
+    """
+    get memory of the process, private memory is the part not shared with other workers
+    :return: dict: resident, proportional and private memory in MB (only resident without procfs)
+    """
+    usage = {'pid': os.getpid(), 'rss_mb': round(rss_mb(), 1)}
+    try:
+        fields = {}
+        with open('/proc/self/smaps_rollup') as smaps:
+            for line in smaps:
+                field, value = line.split(':', 1)
+                fields[field] = value.split()[0]
+        usage['pss_mb'] = round(int(fields['Pss']) / 1024, 1)
+        usage['private_mb'] = round((int(fields['Private_Clean']) + int(fields['Private_Dirty'])) / 1024, 1)
+    except (OSError, KeyError, ValueError, IndexError):
+        pass
+    return usage
+
+
+def _fingerprint(files: list) -> str:
+    """
+    identify the current content of weight files from their size and modification time,
+    side files saved next to them (arrays of gensim models, '<file>.*.npy') included
+    :param files: list: paths of weight files
+    :return: str: short hash of the files state
+    """
+    paths = [side_file for path in files for side_file in [path] + sorted(glob.glob(glob.escape(path) + '.*.npy'))]
+    states = []
+    for path in paths:
+        try:
+            file_stat = os.stat(path)
+            states.append(f'{path}:{file_stat.st_size}:{file_stat.st_mtime_ns}')
+        except OSError:
+            states.append(f'{path}:missing')
+    return hashlib.sha1('|'.join(states).encode('utf-8')).hexdigest()[:12]
+
+
+def register(name: str, loader, files: list = ()):
+    """
+    register a loader for a model, the model is loaded on first use or with preload
+    :param name: str: name of the model in the registry
+    :param loader: function without argument returning the loaded model
+    :param files: list: weight files read by the loader
+    """
+    with _registry_lock:
+        _loaders[name] = (loader, list(files))
+        _locks.setdefault(name, threading.Lock())
+
+
+def _load(name: str):
+    loader, files = _loaders[name]
+    files_version = _fingerprint(files)
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    loaded_model = loader()
+    load_time = time.perf_counter() - start
+    _stats[name] = {
+        'files': files,
+        'version': files_version,
+        'load_time': round(load_time, 3),
+        'memory_mb': round(rss_mb() - rss_before, 1),
+        'loaded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'nb_load': _stats.get(name, {}).get('nb_load', 0) + 1
+    }
+    print(f'Model {name} loaded in {load_time:.2f}s ({_stats[name]["memory_mb"]} MB)')
+    return loaded_model
+
+
+def _outdated(name: str) -> bool:
+    # weight files changed since the model was loaded, and not to a version that failed to load
+    files_version = version(name)
+    return _stats[name]['version'] != files_version and _failed_versions.get(name) != files_version
+
+
+def get(name: str):
+    """
+    get a model from the registry, loading it if it is not loaded yet
+    or if its weight files changed since it was loaded
+    if the changed files can not be loaded (a file being written), the loaded model is kept
+    :param name: str: name of the model
+    :return: loaded model
+    """
+    if name not in _models or _outdated(name):
+        with _locks[name]:
+            # another request may have loaded the model while waiting for the lock
+            if name not in _models:
+                _models[name] = _load(name)
+            elif _outdated(name):
+                files_version = version(name)
+                try:
+                    _models[name] = _load(name)
+                except Exception as error:
+                    _failed_versions[name] = files_version
+                    print(f'Model {name} not reloaded, previous version kept : {error!r}')
+    return _models[name]
+
+
+def version(name: str) -> str:
+    """
+    get the version of a model from the current state of its weight files, without loading it
+    :param name: str: name of the model
+    :return: str: version of the model
+    """
+    return _fingerprint(_loaders[name][1])
+
+
+def reload(name: str):
+    """
+    load the model again from its weight files and swap it with the current one,
+    requests already using the old model end with it
+    :param name: str: name of the model
+    :return: newly loaded model
+    """
+    with _locks[name]:
+        _models[name] = _load(name)
+    return _models[name]
+
+
+def preload(names: list = None):
+    """
+    load models before serving requests
+    :param names: list: names of the models to load (all registered models if None)
+    """
+    for name in names if names is not None else list(_loaders):
+        get(name)
+
+
+def warm_up(names: list = None) -> threading.Thread:
+    """
+    load models in a background thread, requests are served meanwhile
+    and wait for a model only if they need it before it is loaded
+    :param names: list: names of the models to load (all registered models if None)
+    :return: Thread: thread loading the models
+    """
+    def load_models():
+        try:
+            preload(names)
+        except Exception as error:
+            print(f'Warm-up failed : {error!r}')
+
+    thread = threading.Thread(target=load_models, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def is_loaded(name: str) -> bool:
+    """
+    :param name: str: name of the model
+    :return: bool: True if the model is loaded
+    """
+    return name in _models
+
+
+def stats() -> dict:
+    """
+    get loading time and memory of every registered model
+    :return: dict: stats per model name
+    """
+    return {name: {'loaded': name in _models, **_stats.get(name, {})} for name in _loaders}
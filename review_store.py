@@ -0,0 +1,159 @@
+import os
+import re
+import operator
+import threading
+from datetime import datetime
+from functools import reduce
+import pandas as pd
+
+import cache
+import parsers
+
+try:
+    import fcntl
+except ImportError:
+    # no lock between processes on Windows, the api is served by gunicorn on unix
+    fcntl = None
+
+# analysed reviews in parquet files, one folder per category, site and month of publication:
+# <STORE_DIR>/category=<category>/site=<site>/month=<YYYY-MM>/reviews.parquet
+STORE_DIR = os.environ.get('REVIEW_STORE_DIR', os.path.join(cache.CACHE_DIR, 'reviews'))
+# 'off' to stop storing analysed reviews
+ENABLED = os.environ.get('REVIEW_STORE', 'on') != 'off'
+
+COLUMNS = ['note', 'titre', 'comment', 'date', 'published', 'review', 'sentiment', 'model', 'scraped_at']
+# a review predicted again by the same model replaces the stored one
+KEY = ['date', 'titre', 'comment', 'model']
+# categories are folder names, any other character could lead outside STORE_DIR
+CATEGORY_PATTERN = re.compile(r'[\w-]+')
+
+_lock = threading.Lock()
+
+
+def _schema():
+    # pyarrow is imported on first use of the store
+    import pyarrow as pa
+    return pa.schema([
+        ('note', pa.string()),
+        ('titre', pa.string()),
+        ('comment', pa.string()),
+        ('date', pa.string()),
+        ('published', pa.timestamp('us')),
+        ('review', pa.list_(pa.string())),
+        ('sentiment', pa.int8()),
+        ('model', pa.string()),
+        ('scraped_at', pa.timestamp('us')),
+    ])
+
+
+def reviews_frame(preprocessed: pd.DataFrame, predicted: pd.DataFrame, model_to_test: str) -> pd.DataFrame:
+    """
+    gather scraped infos, preprocessed words and sentiment of every predicted review
+    :param preprocessed: dataframe from process.preprocess_df
+    :param predicted: dataframe from pipeline.predict, with the index of the preprocessed reviews
+    :param model_to_test: str: model used for prediction
+    :return: dataframe: site, month and COLUMNS
+    """
+    scraped = preprocessed.loc[predicted.index]
+    df = pd.DataFrame({
+        'site': scraped['site'],
+        'note': scraped['note'],
+        'titre': scraped['titre'],
+        'comment': scraped['comment'],
+        'date': scraped['date'],
+        'published': scraped['published'] if 'published' in scraped else parsers.parse_dates(scraped['date']),
+        'review': [list(review) for review in predicted['review']],
+        'sentiment': predicted['sentiment'].astype('int8'),
+        'model': model_to_test,
+        'scraped_at': pd.Timestamp(datetime.now().replace(microsecond=0))
+    })
+    df['month'] = df['published'].dt.strftime('%Y-%m').fillna('unknown')
+    return df
+
+
+def _check_category(category: str):
+    if not isinstance(category, str) or not CATEGORY_PATTERN.fullmatch(category):
+        raise ValueError(f'Invalid category : {category!r}')
+
+
+def _partition(category: str, site: str, month: str) -> str:
+    _check_category(category)
+    return os.path.join(STORE_DIR, f'category={category}', f'site={site}', f'month={month}', 'reviews.parquet')
+
+
+def save(category: str, preprocessed: pd.DataFrame, predicted: pd.DataFrame, model_to_test: str):
+    """
+    add analysed reviews to the store, to postprocess them again without scraping
+    each partition touched is read, merged with the new reviews and written again,
+    under a lock file of the partition shared by every process
+    :param category: str: category of the sites
+    :param preprocessed: dataframe from process.preprocess_df
+    :param predicted: dataframe from pipeline.predict
+    :param model_to_test: str: model used for prediction
+    :raise ValueError: if the category is not a folder name
+    """
+    if not ENABLED or len(predicted) == 0:
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _schema()
+    df = reviews_frame(preprocessed, predicted, model_to_test)
+
+    with _lock:
+        for (site, month), reviews in df.groupby(['site', 'month']):
+            path = _partition(category, site, month)
+            reviews = reviews[COLUMNS]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # files starting with '.' are ignored when the store is read
+            with open(os.path.join(os.path.dirname(path), '.reviews.lock'), 'w') as lock_file:
+                # another worker merging the same partition would lose the reviews written in between
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if os.path.isfile(path):
+                    stored = pq.read_table(path, memory_map=True).to_pandas()
+                    reviews = pd.concat([stored, reviews], ignore_index=True).drop_duplicates(KEY, keep='last')
+                # written next to the partition then renamed, readers never see a partial file
+                tmp_path = os.path.join(os.path.dirname(path), f'.reviews.{os.getpid()}.{threading.get_ident()}.tmp')
+                pq.write_table(pa.Table.from_pandas(reviews, schema=schema, preserve_index=False), tmp_path)
+                os.replace(tmp_path, path)
+
+
+def load(category: str, sites: list = None, model_to_test: str = None, since: datetime = None) -> pd.DataFrame:
+    """
+    read stored reviews of a category, filters are applied while reading:
+    folders of other sites and older months are skipped, files are memory-mapped
+    :param category: str: category of the sites
+    :param sites: list: sites to read (all sites if None)
+    :param model_to_test: str: keep only predictions of this model (all models if None)
+    :param since: datetime: keep only reviews published since this date
+    :return: dataframe: site, note, titre, comment, date, published, review, sentiment, model, scraped_at
+    :raise ValueError: if the category is not a folder name
+    """
+    _check_category(category)
+    directory = os.path.abspath(os.path.join(STORE_DIR, f'category={category}'))
+    if not os.path.isdir(directory):
+        return pd.DataFrame(columns=['site'] + COLUMNS)
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    partition_fields = [pa.field('site', pa.string()), pa.field('month', pa.string())]
+    dataset = ds.dataset(directory, schema=pa.schema(list(_schema()) + partition_fields), format='parquet',
+                         partitioning=ds.partitioning(pa.schema(partition_fields), flavor='hive'),
+                         filesystem=fs.LocalFileSystem(use_mmap=True))
+
+    conditions = []
+    if sites is not None:
+        conditions.append(ds.field('site').isin(list(sites)))
+    if model_to_test is not None:
+        conditions.append(ds.field('model') == model_to_test)
+    if since is not None:
+        # month folders are compared first, then dates of the remaining files
+        conditions.append(ds.field('month') >= since.strftime('%Y-%m'))
+        conditions.append(ds.field('published') >= pa.scalar(since, type=pa.timestamp('us')))
+    table = dataset.to_table(filter=reduce(operator.and_, conditions) if conditions else None)
+
+    df = table.to_pandas()[['site'] + COLUMNS]
+    df['review'] = df['review'].map(list)
+    return df.sort_values(['site', 'published'], ascending=[True, False], ignore_index=True)
+
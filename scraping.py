@@ -1,19 +1,13 @@
-import requests
-from bs4 import BeautifulSoup
 import pandas as pd
-import re
-from numpy import random
-from time import sleep
-
-# headers to don't be stopped from scraping website
-HEADERS1 = {
-    'Access-Control-Allow-Origin': '*',
-    'Access-Control-Allow-Methods': 'GET',
-    'Access-Control-Allow-Headers': 'Content-Type',
-    'Access-Control-Max-Age': '3600',
-    'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:52.0) Gecko/20100101 Firefox/52.0'
-}
-HEADERS2 = {
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+import fetch
+import history
+import parsers
+
+# headers sent with every request of the shared session, to don't be stopped from scraping website
+HEADERS = {
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3',
     'Accept-Encoding': 'gzip',
     'Accept-Language': 'en-US,en;q=0.9,es;q=0.8',
@@ -21,57 +15,89 @@ HEADERS2 = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/76.0.3809.132 Safari/537.36'
 }
 
-HEADERS3 = {
-    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-    'Accept-Encoding': "gzip, deflate, br",
-    'Accept-Language': 'fr,fr-FR;q=0.8,en-US;q=0.5,en;q=0.3',
-    'Host': 'httpbin.org',
-    'Referer': 'https://www.codementor.io/@scrapingdog/10-tips-to-avoid-getting-blocked-while-scraping-websites-16papipe62',
-    'Upgrade-Insecure-Requests': '1',
-    'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:86.0) Gecko/20100101 Firefox/86.0',
-    'X-Amzn-Trace-Id': 'Root=1-605b2159-39d5af5a4452cae6540ca5e2'
-}
+# shared session for every scraping request
+fetcher = fetch.Fetcher(headers=HEADERS)
+
+# terminations of full site names
+SITE_ENDS = ['.fr', '.com']
 
-headers = [HEADERS1, HEADERS2, HEADERS3]
+# full site name per site name found on category pages, searched again after 30 days
+names_cache = cache.Cache('site_names', max_age=30 * 24 * 3600)
 
-def scrape_category(category: str, location: str, num_of_site: int) -> list:
+def resolve_site_name(site: str, site_fetcher: fetch.Fetcher) -> str:
+    """
+    search a site name on trustpilot to get the full site name
+    from "Flashbay" we want "flashbay.fr"
+    from "Cadeaucity" we want "www.cadeaucity.com"
+    :param site: str: site name without '.fr' or '.com'
+    :param site_fetcher: Fetcher: fetcher used for the search
+    :return: str: full site name, empty if not found
+    """
+    url2 = f"{fetch.BASE_URL}/search?query={site}"
+
+    similar_site = []
+    # selection of all possible url per site
+    for final_site in parsers.parse_search_page(site_fetcher.get(url2)):
+        final_site = final_site.split(' | ')
+        if final_site[0] == site:
+            similar_site.append(final_site[1])
+
+    # selection of url with good termination
+    # will keep 'ensuite.fr' instead of 'www.ensuite.de'
+    for elt in similar_site:
+        if any(substring in elt.lower() for substring in SITE_ENDS):
+            return elt
+    return ''
+
+
+def resolve_site_names(names: list, site_fetcher: fetch.Fetcher) -> dict:
+    """
+    get the full site name of site names, from names_cache or searched in parallel on trustpilot
+    :param names: list: site names without '.fr' or '.com'
+    :param site_fetcher: Fetcher: fetcher used for the searches
+    :return: dict: full site name per site name, empty if not found
+    """
+    resolved = names_cache.get_many(names)
+    missing = [name for name in dict.fromkeys(names) if name not in resolved]
+    if missing:
+        with ThreadPoolExecutor(site_fetcher.workers) as executor:
+            new_names = dict(zip(missing, executor.map(lambda name: resolve_site_name(name, site_fetcher),
+                                                       missing)))
+        names_cache.set_many(new_names)
+        resolved.update(new_names)
+    return resolved
+
+
+def scrape_category(category: str, location: str, num_of_site: int, site_fetcher: fetch.Fetcher = None) -> list:
     """
     scrape a given category to have a list of site to use in scrape_site
+    category pages stop being scraped once num_of_site sites are found,
+    the list of site then only holds the sites found
     :param category: str: category to scrape
     :param location: str: city where to search category
     :param num_of_site: int: number of site to scrape
+    :param site_fetcher: Fetcher: fetcher to use instead of the shared one
     :return: list: list of site and refs to scrape in the param category
     """
-
+    site_fetcher = site_fetcher or fetcher
     list_of_site = []
-    site_to_scrape = []
 
     page_to_scrape = True
     num_page = 1
     while page_to_scrape:
-        # Change header every page
-        header = headers[num_page % len(headers)]
         # url to scrape
-        url = f"https://fr.trustpilot.com/categories/{category}?page={num_page}&timeperiod=0"
+        url = f"{fetch.BASE_URL}/categories/{category}?page={num_page}&timeperiod=0"
 
         if location != 'no city':
             # url with location
             url += f"&location={location}"
 
-        try:
-            req = requests.get(url, header, timeout=1)  # wait 1 second before sending error
-        except:
-            req = requests.get(url, header)  # try request a second time
-
-        soup = BeautifulSoup(req.content, 'html.parser')
         # search site name into category page
-        for site in soup.find_all(["div"], attrs={"class": "styles_businessTitle__1IANo"}):
-            site = site.text.strip()
-            list_of_site.append(site)
+        sites, next_page = parsers.parse_category_page(site_fetcher.get(url))
+        list_of_site.extend(sites)
 
-        # check if there is a page after the current one
-        tag = soup.find(["a"], attrs={"name": "pagination-button-next"})
-        if tag:
+        # check if there is a page after the current one and if more sites are needed
+        if next_page and (num_of_site == 0 or len(set(list_of_site)) < num_of_site):
             num_page += 1
         else:
             page_to_scrape = False
@@ -83,134 +109,116 @@ def scrape_category(category: str, location: str, num_of_site: int) -> list:
     if num_of_site > len(list_of_site) or num_of_site == 0:
         num_of_site = len(list_of_site)
 
-    site_to_remove = []
+    # Check if 'n'existe plus' is in site name to remove it
+    site_to_remove = [site for site in list_of_site[:num_of_site] if "n'existe plus" in site.lower()]
+    # check if adress already finish by '.fr' or '.com', else search the full site name
+    names = [site for site in list_of_site[:num_of_site]
+             if site not in site_to_remove and not any(substring in site.lower() for substring in SITE_ENDS)]
+    resolved = resolve_site_names(names, site_fetcher)
 
+    site_to_scrape = []
     for site in list_of_site[:num_of_site]:
-        end = ['.fr', '.com']
-        # Check if 'n'existe plus' is in site name to remove it
-        if "n'existe plus" in site.lower():
-            site_to_remove.append(site)
-        # check if adress already finish by '.fr' or '.com'
-        # if True url2 will lead to nothing
-        elif any(substring in site.lower() for substring in end):
+        if site in site_to_remove:
+            continue
+        site = resolved.get(site, site)
+        if site:
             site_to_scrape.append(site)
-        else:
-            # scrape a new url with the site name to get full site name
-            # from "Flashbay" we want "flashbay.fr"
-            # from "Cadeaucity" we want "www.cadeaucity.com"
-            url2 = f"https://fr.trustpilot.com/search?query={site}"
-            try:
-                req2 = requests.get(url2, header, timeout=1)  # wait 1 second before sending error
-            except:
-                req2 = requests.get(url2, header)
-
-            soup2 = BeautifulSoup(req2.content, 'html.parser')
-
-            similar_site = []
-            # selection of all possible url per site
-            for final_site in soup2.find_all(["a"], attrs={"class": "search-result-heading"}):
-                final_site = final_site.text.split(' | ')
-                if final_site[0] == site:
-                    similar_site.append(final_site[1])
-
-            # selection of url with good termination
-            # will keep 'ensuite.fr' instead of 'www.ensuite.de'
-            for elt in similar_site:
-                if any(substring in elt.lower() for substring in end):
-                    site_to_scrape.append(elt)
-                    break
+
     list_of_site = [x for x in list_of_site if x not in site_to_remove]
     return [list_of_site, site_to_scrape]
 
 
-def scrape_site(refs: list, max_page) -> pd.DataFrame:
+def scrape_reviews(site: str, max_page: int, site_fetcher: fetch.Fetcher, since: str = None) -> list:
     """
-    scrape a list of sites on trustpilottrustpilot
+    scrape the reviews of one site on trustpilot, page after page
+    :param site: str: site to scrape
+    :param max_page: max number of page to scrape (0 for all pages)
+    :param site_fetcher: Fetcher: fetcher used for every page
+    :param since: str: publishedDate of the newest review already scraped,
+    reviews are newest first so scraping stops at the first review not newer than it
+    :return: list: list of infos per review
+    """
+    infos = []
+    page_to_scrape = True
+    num_page = 1
+
+    # scrape while there is page to scrape or max number of page is reached
+    while page_to_scrape:
+        # url to scrape
+        url = f"{fetch.BASE_URL}/review/{site}?page={num_page}"
+        # get infos for every review for one site
+        page_infos, next_page = parsers.parse_review_page(site_fetcher.get(url), site)
+        for info in page_infos:
+            # stop at the first review already scraped
+            if since and len(info) == 5 and info[-1] <= since:
+                return infos
+            infos.append(info)
+
+        # check if there is a page after the current one
+        if next_page and num_page != max_page:
+            num_page += 1
+        else:
+            page_to_scrape = False
+    return infos
+
+
+def scrape_new_reviews(site: str, max_page: int, site_fetcher: fetch.Fetcher) -> list:
+    """
+    scrape only the reviews of one site published since last scraping, and merge them with history
+    :param site: str: site to scrape
+    :param max_page: max number of page to scrape at first scraping (0 for all pages), next scrapings read
+    every page until the last review scraped, so that history has no gap between new and stored reviews
+    :param site_fetcher: Fetcher: fetcher used for every page
+    :return: list: list of infos per review, new reviews then stored reviews
+    """
+    stored_infos = history.load(site)
+    since = history.newest_date(site)
+    new_infos = scrape_reviews(site, 0 if since else max_page, site_fetcher, since=since)
+    # only complete reviews have a date to compare with next scrapings
+    history.save(site, [info for info in new_infos if len(info) == 5])
+
+    new_reviews = {tuple(info) for info in new_infos}
+    return new_infos + [info for info in stored_infos if tuple(info) not in new_reviews]
+
+
+def scrape_site(refs: list, max_page, site_fetcher: fetch.Fetcher = None, incremental: bool = False) -> pd.DataFrame:
+    """
+    scrape a list of sites on trustpilot, sites are scraped in parallel
     :param refs: list: list of site to scrape
     :param max_page: max number of page to scrape on each site
+    :param site_fetcher: Fetcher: fetcher to use instead of the shared one
+    :param incremental: bool: scrape only reviews published since last scraping and add stored reviews
     :return: dataframe
     """
-    # initialization of variable infos
-    infos = []
-    # iteration over list of sites
-    for site in refs:
-        page_to_scrape = True
-        num_page = 1
-
-        # scrape while there is page to scrape or max number of page is reached
-        while page_to_scrape:
-            # change header each page
-            header = headers[num_page % len(headers)]
-            # add a sleep time for each page
-            sleeptime = random.uniform(0, 3)
-            sleep(sleeptime)
-
-            # url to scrape
-            url = f"https://fr.trustpilot.com/review/{site}?page={num_page}"
-
-            try:
-                req = requests.get(url, header, timeout=1)  # wait 1 second before sending error
-            except:
-                req = requests.get(url, header)
-            soup = BeautifulSoup(req.content, 'html.parser')
-
-            # get infos for every review for one site
-            for opinion in soup.find_all(["div"], attrs={"class": "review-content"}):
-                info = [site]
-
-                # get number of stars
-                star = opinion.find(["div"], attrs={"class": "star-rating star-rating--medium"})
-                img = star.find('img')
-                if img:
-                    info.append(img['alt'])
-
-                # get title
-                title = opinion.find('h2', attrs={'class': 'review-content__title'})
-                if title:
-                    info.append(title.text.strip())
-
-                # get review content
-                content = opinion.find(["p"], attrs={"class": "review-content__text"})
-                if content:
-                    info.append(content.text.strip())
-                else:
-                    info.append('')
-
-                # get date of post
-                date_of_post = opinion.find(['div'], attrs={"class": 'review-content-header__dates'})
-                if date_of_post:
-                    date_of_post = str(date_of_post)
-                    date_of_post = re.search('"publishedDate":"(.*)","updatedDate', date_of_post).group(1)
-                    info.append(date_of_post)
-                infos.append(info)
-
-            # check if there is a page after the current one
-            tag = soup.find(["a"], attrs={"class": "button button--primary next-page"})
-            if tag and num_page != max_page:
-                num_page += 1
-            else:
-                page_to_scrape = False
-
-    # create pandas dataframe
+    site_fetcher = site_fetcher or fetcher
+    scrape_one_site = scrape_new_reviews if incremental else scrape_reviews
+    # iteration over list of sites, results are kept in the order of refs
+    with ThreadPoolExecutor(site_fetcher.workers) as executor:
+        infos_per_site = executor.map(lambda site: scrape_one_site(site, max_page, site_fetcher), refs)
+        infos = [info for site_infos in infos_per_site for info in site_infos]
+
+    # create pandas dataframe, dates are parsed once for every time window of postprocess
     df = pd.DataFrame(infos, columns=['site', 'note', 'titre', 'comment', 'date'])
+    df['published'] = parsers.parse_dates(df['date'])
     pd.set_option('display.max_columns', None)
     pd.set_option('display.expand_frame_repr', False)
     return df
 
 
-def scrape(category: str, location: str, num_of_site: int, num_page: int) -> tuple:
+def scrape(category: str, location: str, num_of_site: int, num_page: int, incremental: bool = False) -> tuple:
     """
     scrape truspilot reviews
     :param category: str: category to scrape
     :param location: str: city where to search category
     :param num_of_site: int: number of site to scrape (0 for all site)
     :param num_page: int: number of page to scrape on each site (0 for all pages)
+    :param incremental: bool: scrape only reviews published since last scraping and add stored reviews
     :return: tuple: tuple with refs from scrape_category and dataframe with scraped data
     """
     # 1. scrape trustpilot for a specific category, location and number of site and get references to scrape
     refs = scrape_category(category, location, num_of_site)
     # 2. scrape truspilot for specific references and num of pages and get a pandas dataframe
-    df = scrape_site(refs[1], num_page)
+    df = scrape_site(refs[1], num_page, incremental=incremental)
     return refs, df
 
 
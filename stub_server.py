@@ -0,0 +1,143 @@
+import os
+import sys
+import hashlib
+import tempfile
+import threading
+from email.utils import formatdate
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# recorded trustpilot pages
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'trustpilot')
+
+
+def fixture_path(directory: str, url: str) -> str:
+    """
+    get the file of a recorded trustpilot page
+    /categories/<category>?page=<n> -> categories/<category>/page-<n>.html
+    /review/<site>?page=<n> -> review/<site>/page-<n>.html
+    /search?query=<name> -> search/<name>.html
+    :param directory: str: folder of recorded pages
+    :param url: str: url or path of the page
+    :return: str: path of the recorded page
+    """
+    parts = urlsplit(url)
+    params = parse_qs(parts.query)
+    path = unquote(parts.path).strip('/')
+    if path == 'search':
+        return os.path.join(directory, 'search', f"{params.get('query', [''])[0]}.html")
+    return os.path.join(directory, path, f"page-{params.get('page', ['1'])[0]}.html")
+
+
+def record(url: str, content: bytes, directory: str = FIXTURES_DIR):
+    """
+    save a page fetched on trustpilot so that the stub server can serve it
+    :param url: str: url of the page
+    :param content: bytes: content of the page
+    :param directory: str: folder of recorded pages
+    """
+    path = fixture_path(directory, url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+def synthesize(directory: str, nb_sites: int, category: str = 'restaurants_bars', sites_per_page: int = 20,
+               source: str = FIXTURES_DIR) -> list:
+    """
+    build a larger trustpilot from recorded pages, to scale benchmarks beyond the recorded sites
+    category pages list nb_sites sites 'site-<n>.fr', each one replaying the review pages of a recorded site
+    :param directory: str: folder where pages are written, to serve with start(directory)
+    :param nb_sites: int: number of sites of the category
+    :param category: str: category listing the sites
+    :param sites_per_page: int: number of sites per category page
+    :param source: str: folder of recorded pages
+    :return: list: names of the sites
+    """
+    recorded = sorted(os.listdir(os.path.join(source, 'review')))
+    sites = [f'site-{i}.fr' for i in range(nb_sites)]
+
+    # review pages of site n are the pages of the recorded site n modulo the number of recorded sites
+    for i, site in enumerate(sites):
+        site_dir = os.path.join(directory, 'review', site)
+        os.makedirs(site_dir, exist_ok=True)
+        recorded_dir = os.path.join(source, 'review', recorded[i % len(recorded)])
+        for page in os.listdir(recorded_dir):
+            with open(os.path.join(recorded_dir, page), 'rb') as file:
+                content = file.read()
+            with open(os.path.join(site_dir, page), 'wb') as file:
+                file.write(content)
+
+    # category pages with the markup of recorded category pages
+    category_dir = os.path.join(directory, 'categories', category)
+    os.makedirs(category_dir, exist_ok=True)
+    nb_pages = max(1, -(-nb_sites // sites_per_page))
+    for page in range(1, nb_pages + 1):
+        links = ''.join(f'      <a class="link_internal__YpiJI" href="/review/{site}">\n'
+                        f'        <div class="styles_businessTitle__1IANo">{site}</div>\n'
+                        f'      </a>\n'
+                        for site in sites[(page - 1) * sites_per_page:page * sites_per_page])
+        next_page = ''
+        if page < nb_pages:
+            next_page = (f'    <a class="button_button__3sN8k" name="pagination-button-next" '
+                         f'href="/categories/{category}?page={page + 1}">Suivant</a>\n')
+        with open(os.path.join(category_dir, f'page-{page}.html'), 'w', encoding='utf-8') as file:
+            file.write('<!DOCTYPE html>\n<html lang="fr-FR">\n<head>\n  <meta charset="utf-8">\n'
+                       f'  <title>{category} | Trustpilot</title>\n</head>\n<body>\n  <main class="main">\n'
+                       f'    <div class="styles_businessList__3tSKv">\n{links}    </div>\n{next_page}'
+                       '  </main>\n</body>\n</html>\n')
+    return sites
+
+
+def make_handler(directory: str):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = fixture_path(directory, self.path)
+            if not os.path.isfile(path):
+                self.send_error(404)
+                return
+            with open(path, 'rb') as file:
+                content = file.read()
+            # pages can be revalidated with their ETag
+            etag = f'"{hashlib.sha1(content).hexdigest()}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', formatdate(os.path.getmtime(path), usegmt=True))
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def start(directory: str = FIXTURES_DIR, port: int = 0) -> ThreadingHTTPServer:
+    """
+    serve recorded trustpilot pages in a background thread
+    use it in scraping with TRUSTPILOT_URL=http://127.0.0.1:<port> or by setting fetch.BASE_URL
+    :param directory: str: folder of recorded pages
+    :param port: int: port of the server (random free port if 0)
+    :return: ThreadingHTTPServer: running server, stop it with shutdown()
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    # python stub_server.py [port] [number of synthetic sites]
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    directory = FIXTURES_DIR
+    if len(sys.argv) > 2:
+        directory = tempfile.mkdtemp(prefix='trustpilot_')
+        synthesize(directory, int(sys.argv[2]))
+    print(f'Serving {directory} on http://127.0.0.1:{port}')
+    ThreadingHTTPServer(('127.0.0.1', port), make_handler(directory)).serve_forever()
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# modules of the api are at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    # on-disk caches in a temporary folder, paths computed at import (jobs, review store) are set by each test
+    import cache
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path))
+    return tmp_path
@@ -0,0 +1,82 @@
+import cache
+
+
+def nb_stored(values: cache.Cache) -> int:
+    return values._connect().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+def age(values: cache.Cache, seconds: float):
+    # values written seconds earlier
+    connection = values._connect()
+    with connection:
+        connection.execute('UPDATE cache SET created = created - ?', (seconds,))
+    values.memory.clear()
+
+
+def test_memory_keeps_last_used_values(cache_dir):
+    values = cache.Cache('lru', memory_size=2)
+    values.set_many({'a': 1, 'b': 2, 'c': 3})
+    assert list(values.memory) == ['b', 'c']
+
+    # values evicted from memory are read from disk and used again
+    assert values.get('a') == 1
+    assert list(values.memory) == ['c', 'a']
+    assert values.get_many(['a', 'b', 'd']) == {'a': 1, 'b': 2}
+    assert values.stats() == {'hits': 3, 'misses': 1}
+
+
+def test_values_are_shared_through_disk(cache_dir):
+    cache.Cache('shared', memory_size=0).set('key', {'sites': ['a.fr']})
+    assert cache.Cache('shared', memory_size=0).get('key') == {'sites': ['a.fr']}
+
+
+def test_get_with_age(cache_dir):
+    values = cache.Cache('age', memory_size=0)
+    assert values.get_with_age('key') == (None, None)
+
+    values.set('key', 'value')
+    age(values, 100)
+    value, value_age = values.get_with_age('key')
+    assert value == 'value'
+    assert 100 <= value_age < 110
+
+
+def test_old_values_are_evicted(cache_dir):
+    values = cache.Cache('max_age', max_age=60)
+    values.set('old', 1)
+    age(values, 120)
+
+    assert values.get('old') is None
+    values.set('new', 2)
+    assert nb_stored(values) == 1
+    assert values.get('new') == 2
+
+
+def test_oldest_values_are_evicted_above_max_entries(cache_dir):
+    values = cache.Cache('max_entries', memory_size=0, max_entries=10)
+    for index in range(10):
+        values.set(f'key{index}', index)
+        age(values, 1)
+    assert nb_stored(values) == 10
+
+    # EVICTION_MARGIN more values are evicted
+    values.set('key10', 10)
+    assert nb_stored(values) == int(10 * (1 - cache.EVICTION_MARGIN))
+    assert values.get_many([f'key{index}' for index in range(11)]) == {f'key{index}': index for index in range(2, 11)}
+
+
+def test_values_written_by_other_processes_are_counted(cache_dir):
+    values = cache.Cache('estimate', memory_size=0, max_entries=10)
+    values.set('key0', 0)
+    # written by another process
+    connection = values._connect()
+    with connection:
+        connection.executemany('INSERT INTO cache (key, value, created) VALUES (?, ?, 0)',
+                               [(f'other{index}', str(index)) for index in range(1, 20)])
+
+    # values of the other process are not in the estimate until the table is counted, once the estimate goes above
+    for index in range(1, 10):
+        values.set(f'key{index}', index)
+    assert nb_stored(values) == 29
+    values.set('key10', 10)
+    assert nb_stored(values) == int(10 * (1 - cache.EVICTION_MARGIN))
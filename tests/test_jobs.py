@@ -0,0 +1,138 @@
+import sys
+import time
+import threading
+import subprocess
+
+import pytest
+
+import jobs
+import pipeline
+
+
+@pytest.fixture
+def jobs_db(monkeypatch, cache_dir):
+    monkeypatch.setattr(jobs, 'JOBS_PATH', str(cache_dir / 'jobs.sqlite'))
+    monkeypatch.setattr(jobs, '_connection', None)
+    monkeypatch.setattr(jobs, '_callbacks', {})
+    return jobs.JOBS_PATH
+
+
+@pytest.fixture
+def blocked_analyse(monkeypatch):
+    # analyses wait until the test releases them
+    release = threading.Event()
+
+    def analyse(params, progress=None):
+        release.wait(10)
+        return {'category': params['category']}
+
+    monkeypatch.setattr(pipeline, 'analyse', analyse)
+    yield release
+    release.set()
+
+
+def wait_finished(job_id: str) -> dict:
+    for _ in range(200):
+        job = jobs.get(job_id)
+        if job['finished_at'] is not None:
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+def wait_until(condition):
+    for _ in range(200):
+        if condition():
+            return
+        time.sleep(0.05)
+    raise TimeoutError()
+
+
+def params(category: str) -> dict:
+    return pipeline.get_params({'category': category})
+
+
+def test_identical_jobs_are_shared(jobs_db, blocked_analyse):
+    results = []
+    job_id = jobs.submit(params('animals_pets'), callback=results.append)
+
+    assert jobs.submit(params('animals_pets'), callback=results.append) == job_id
+    other_id = jobs.submit(params('sports'))
+    assert other_id != job_id
+
+    blocked_analyse.set()
+    job = wait_finished(job_id)
+    assert job['status'] == 'done'
+    assert job['result'] == {'category': 'animals_pets'}
+    # callbacks are called once the job is stored as finished
+    wait_until(lambda: len(results) == 2)
+    assert results == [job['result'], job['result']]
+    wait_finished(other_id)
+    # a finished job is not reused
+    new_id = jobs.submit(params('animals_pets'))
+    assert new_id != job_id
+    wait_finished(new_id)
+
+
+def test_job_of_stopped_worker_is_not_reused(jobs_db, blocked_analyse):
+    # pid of a process which already exited
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    connection = jobs._connect()
+    with connection:
+        connection.execute('INSERT INTO jobs (id, key, pid, params, status, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                           ('lost', jobs.params_key(params('animals_pets')), process.pid, '{}', 'running',
+                            time.time()))
+
+    job_id = jobs.submit(params('animals_pets'))
+
+    assert job_id != 'lost'
+    lost = jobs.get('lost')
+    assert lost['status'] == 'error'
+    assert lost['error'] == f'worker {process.pid} stopped'
+    blocked_analyse.set()
+    assert wait_finished(job_id)['status'] == 'done'
+
+
+def test_stages_not_run_are_skipped(jobs_db, monkeypatch):
+    def analyse(params, progress=None):
+        progress('scraping', 'running')
+        progress('scraping', 'done')
+        return "<h1>Pas de données</h1>"
+
+    monkeypatch.setattr(pipeline, 'analyse', analyse)
+    job = wait_finished(jobs.submit(params('animals_pets')))
+
+    assert job['status'] == 'done'
+    assert job['stages'] == {'scraping': 'done', 'preprocess': 'skipped', 'prediction': 'skipped',
+                             'postprocess': 'skipped'}
+
+
+def test_stages_after_failed_stage_are_skipped(jobs_db, monkeypatch):
+    def analyse(params, progress=None):
+        progress('scraping', 'running')
+        progress('scraping', 'error')
+        raise RuntimeError('site unreachable')
+
+    monkeypatch.setattr(pipeline, 'analyse', analyse)
+    job = wait_finished(jobs.submit(params('animals_pets')))
+
+    assert job['status'] == 'error'
+    assert job['stages'] == {'scraping': 'error', 'preprocess': 'skipped', 'prediction': 'skipped',
+                             'postprocess': 'skipped'}
+
+
+def test_new_jobs_are_refused_above_queue_limit(jobs_db, blocked_analyse, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_QUEUE_LIMIT', 1)
+    job_id = jobs.submit(params('animals_pets'))
+
+    # an identical job is still shared
+    assert jobs.submit(params('animals_pets')) == job_id
+    with pytest.raises(jobs.QueueFull):
+        jobs.submit(params('sports'))
+
+    blocked_analyse.set()
+    wait_finished(job_id)
+    other_id = jobs.submit(params('sports'))
+    assert other_id != job_id
+    wait_finished(other_id)
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import parsers
+import process
+
+# days since publication of each review
+AGES = [400, 2, 40, 100, 10, 200, 5, 60]
+
+
+@pytest.fixture
+def reviews() -> pd.DataFrame:
+    now = datetime.now()
+    df = pd.DataFrame({
+        'site': ['lepetitbistrot.fr', 'pizzeria-napoli.fr'] * 4,
+        'date': [(now - timedelta(days=age)).strftime('%Y-%m-%dT%H:%M:%S.000Z') for age in AGES],
+        'review': [['repas', 'excellent'], ['service', 'lent'], ['pizza', 'froide'], ['accueil', 'chaleureux'],
+                   ['attente', 'longue'], ['dessert', 'excellent'], ['serveur', 'désagréable'],
+                   ['terrasse', 'agréable']],
+        'sentiment': [1, 0, 0, 1, 0, 1, 0, 1],
+    })
+    # reviews without date are in no time window
+    df.loc[7, 'date'] = ''
+    return df
+
+
+def published_since(df: pd.DataFrame, start: datetime) -> pd.DataFrame:
+    # reference: reviews filtered by comparing every date
+    return df[parsers.parse_dates(df['date']) >= start]
+
+
+@pytest.mark.parametrize('days', [0, 3, 30, 90, 365, 1000])
+def test_time_index_matches_filter_on_dates(reviews, days):
+    start = datetime.now() - timedelta(days=days)
+
+    index = process.TimeIndex(reviews).since(start)
+
+    assert list(index) == list(published_since(reviews, start).index)
+
+
+def test_time_index_uses_parsed_dates(reviews):
+    published = reviews.assign(published=parsers.parse_dates(reviews['date']))
+    start = datetime.now() - timedelta(days=30)
+
+    assert list(process.TimeIndex(published).since(start)) == list(process.TimeIndex(reviews).since(start))
+    assert 'published' not in reviews.columns
+
+
+@pytest.mark.parametrize('window', ['7d', '30d', '3m', '6m', '24m'])
+def test_get_window_matches_summary_of_filtered_reviews(reviews, window):
+    engine = process.WordCloudEngine(reviews)
+    time_index = process.TimeIndex(reviews)
+
+    summary = process.get_window(reviews, window, engine, time_index)
+
+    assert summary == process.get_summary(published_since(reviews, process.window_start(window)), engine=engine)
+    # time index built if not given
+    assert summary == process.get_window(reviews, window, engine)
+
+
+def test_window_start():
+    now = datetime.now()
+    assert abs(process.window_start('7d') - (now - timedelta(days=7))) < timedelta(seconds=5)
+    assert process.window_start('3m').month == (now.month - 4) % 12 + 1
+
+
+def test_get_last_month_is_3_month_window(reviews):
+    assert process.get_last_month(reviews) == process.get_window(reviews, '3m')
+    assert process.get_last_month(reviews)['nb_review_analysed'] == 4
@@ -0,0 +1,74 @@
+import pytest
+
+import registry
+
+
+@pytest.fixture
+def weights(monkeypatch, tmp_path):
+    # empty registry, model 'test' loads the content of a weight file and of its side files
+    for name in ['_loaders', '_models', '_stats', '_locks', '_failed_versions']:
+        monkeypatch.setattr(registry, name, {})
+    path = tmp_path / 'model.bin'
+    path.write_text('v1')
+    loads = []
+
+    def loader():
+        content = ''.join(file.read_text() for file in sorted(tmp_path.glob('model.bin*')))
+        loads.append(content)
+        if 'broken' in content:
+            raise ValueError('truncated weight file')
+        return content
+
+    registry.register('test', loader, [str(path)])
+    return path, loads
+
+
+def test_model_is_loaded_once(weights):
+    _, loads = weights
+    assert not registry.is_loaded('test')
+
+    assert registry.get('test') == 'v1'
+    assert registry.get('test') == 'v1'
+    assert loads == ['v1']
+    assert registry.stats()['test']['nb_load'] == 1
+
+
+def test_model_is_reloaded_when_weight_files_change(weights):
+    path, _ = weights
+    registry.get('test')
+    version = registry.version('test')
+
+    path.write_text('v22')
+    assert registry.version('test') != version
+    assert registry.get('test') == 'v22'
+    assert registry.stats()['test']['nb_load'] == 2
+    assert registry.stats()['test']['version'] == registry.version('test')
+
+
+def test_side_files_are_part_of_the_version(weights):
+    path, _ = weights
+    registry.get('test')
+
+    (path.parent / 'model.bin.vectors.npy').write_text('+vectors')
+    assert registry.get('test') == 'v1+vectors'
+
+
+def test_failed_reload_keeps_loaded_model(weights):
+    path, loads = weights
+    registry.get('test')
+
+    path.write_text('broken')
+    assert registry.get('test') == 'v1'
+    # files that failed to load are not tried again until they change
+    assert registry.get('test') == 'v1'
+    assert loads == ['v1', 'broken']
+
+    path.write_text('v3')
+    assert registry.get('test') == 'v3'
+
+
+def test_reload_swaps_model(weights):
+    registry.get('test')
+
+    assert registry.reload('test') == 'v1'
+    assert registry.stats()['test']['nb_load'] == 2
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import pipeline
+import review_store
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def store_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(review_store, 'STORE_DIR', str(tmp_path / 'reviews'))
+    return tmp_path / 'reviews'
+
+
+@pytest.fixture
+def analysed() -> tuple:
+    # preprocessed and predicted reviews as given by pipeline.analyse, one review without date
+    preprocessed = pd.DataFrame({
+        'site': ['lepetitbistrot.fr', 'lepetitbistrot.fr', 'pizzeria-napoli.fr', 'pizzeria-napoli.fr'],
+        'note': ['5', '1', '4', ''],
+        'titre': ['Parfait', 'Décevant', 'Bonne pizza', 'Sans date'],
+        'comment': ['repas excellent', 'service lent', 'pâte fine', 'accueil'],
+        'date': ['2021-03-02T12:00:00.000Z', '2021-01-15T08:30:00.000Z', '2021-03-20T19:00:00.000Z', ''],
+    }, index=[10, 11, 12, 13])
+    predicted = pd.DataFrame({
+        'review': [['repas', 'excellent'], ['service', 'lent'], ['pâte', 'fine'], ['accueil']],
+        'sentiment': [1, 0, 1, 1],
+    }, index=preprocessed.index)
+    return preprocessed, predicted
+
+
+def test_saved_reviews_are_loaded(store_dir, analysed):
+    review_store.save('restaurants_bars', *analysed, 'default')
+
+    df = review_store.load('restaurants_bars')
+
+    assert list(df.columns) == ['site'] + review_store.COLUMNS
+    # sorted by site and most recent first
+    assert list(df['titre']) == ['Parfait', 'Décevant', 'Bonne pizza', 'Sans date']
+    assert list(df['review']) == [['repas', 'excellent'], ['service', 'lent'], ['pâte', 'fine'], ['accueil']]
+    assert list(df['sentiment']) == [1, 0, 1, 1]
+    assert (df['model'] == 'default').all()
+    assert (store_dir / 'category=restaurants_bars' / 'site=lepetitbistrot.fr' / 'month=2021-03' /
+            'reviews.parquet').is_file()
+    assert (store_dir / 'category=restaurants_bars' / 'site=pizzeria-napoli.fr' / 'month=unknown' /
+            'reviews.parquet').is_file()
+
+
+def test_reviews_saved_again_replace_stored_ones(store_dir, analysed):
+    preprocessed, predicted = analysed
+    review_store.save('restaurants_bars', preprocessed, predicted, 'default')
+    review_store.save('restaurants_bars', preprocessed, predicted.assign(sentiment=0), 'default')
+    review_store.save('restaurants_bars', preprocessed.loc[[10]], predicted.loc[[10]], 'camembert')
+
+    df = review_store.load('restaurants_bars')
+    assert len(df) == 5
+    assert list(df.loc[df['model'] == 'default', 'sentiment']) == [0, 0, 0, 0]
+    assert list(review_store.load('restaurants_bars', model_to_test='camembert')['titre']) == ['Parfait']
+
+
+def test_load_filters_sites_and_months(store_dir, analysed):
+    review_store.save('restaurants_bars', *analysed, 'default')
+
+    assert set(review_store.load('restaurants_bars', sites=['pizzeria-napoli.fr'])['titre']) == \
+        {'Bonne pizza', 'Sans date'}
+    assert list(review_store.load('restaurants_bars', since=datetime(2021, 3, 1))['titre']) == \
+        ['Parfait', 'Bonne pizza']
+    assert len(review_store.load('animals_pets')) == 0
+
+
+@pytest.mark.parametrize('category', ['../..', 'restaurants_bars/../..', '', None])
+def test_category_must_be_a_folder_name(store_dir, analysed, category):
+    with pytest.raises(ValueError):
+        review_store.load(category)
+    with pytest.raises(ValueError):
+        review_store.save(category, *analysed, 'default')
+    assert not store_dir.exists()
+
+
+def test_store_error_does_not_stop_analysis(monkeypatch, analysed, capsys):
+    def save(*args):
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(review_store, 'save', save)
+    pipeline.store('restaurants_bars', *analysed, 'default')
+
+    assert 'Reviews not stored' in capsys.readouterr().out
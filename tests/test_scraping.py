@@ -0,0 +1,133 @@
+import re
+from functools import partial
+
+import pandas as pd
+import pytest
+import requests
+from bs4 import BeautifulSoup
+
+import cache
+import fetch
+import parsers
+import scraping
+import stub_server
+
+
+# reference: scraping with html.parser as done before parsers.py, without headers nor sleep between pages
+def legacy_scrape_category(base_url: str, category: str, num_of_site: int) -> list:
+    list_of_site = []
+    site_to_scrape = []
+
+    page_to_scrape = True
+    num_page = 1
+    while page_to_scrape:
+        url = f"{base_url}/categories/{category}?page={num_page}&timeperiod=0"
+        soup = BeautifulSoup(requests.get(url).content, 'html.parser')
+        for site in soup.find_all(["div"], attrs={"class": "styles_businessTitle__1IANo"}):
+            list_of_site.append(site.text.strip())
+        if soup.find(["a"], attrs={"name": "pagination-button-next"}):
+            num_page += 1
+        else:
+            page_to_scrape = False
+
+    list_of_site = list(dict.fromkeys(list_of_site))
+    if num_of_site > len(list_of_site) or num_of_site == 0:
+        num_of_site = len(list_of_site)
+
+    site_to_remove = []
+    for site in list_of_site[:num_of_site]:
+        end = ['.fr', '.com']
+        if "n'existe plus" in site.lower():
+            site_to_remove.append(site)
+        elif any(substring in site.lower() for substring in end):
+            site_to_scrape.append(site)
+        else:
+            soup2 = BeautifulSoup(requests.get(f"{base_url}/search?query={site}").content, 'html.parser')
+            similar_site = []
+            for final_site in soup2.find_all(["a"], attrs={"class": "search-result-heading"}):
+                final_site = final_site.text.split(' | ')
+                if final_site[0] == site:
+                    similar_site.append(final_site[1])
+            for elt in similar_site:
+                if any(substring in elt.lower() for substring in end):
+                    site_to_scrape.append(elt)
+                    break
+    list_of_site = [x for x in list_of_site if x not in site_to_remove]
+    return [list_of_site, site_to_scrape]
+
+
+def legacy_scrape_site(base_url: str, refs: list, max_page) -> pd.DataFrame:
+    infos = []
+    for site in refs:
+        page_to_scrape = True
+        num_page = 1
+        while page_to_scrape:
+            url = f"{base_url}/review/{site}?page={num_page}"
+            soup = BeautifulSoup(requests.get(url).content, 'html.parser')
+            for opinion in soup.find_all(["div"], attrs={"class": "review-content"}):
+                info = [site]
+                star = opinion.find(["div"], attrs={"class": "star-rating star-rating--medium"})
+                img = star.find('img')
+                if img:
+                    info.append(img['alt'])
+                title = opinion.find('h2', attrs={'class': 'review-content__title'})
+                if title:
+                    info.append(title.text.strip())
+                content = opinion.find(["p"], attrs={"class": "review-content__text"})
+                if content:
+                    info.append(content.text.strip())
+                else:
+                    info.append('')
+                date_of_post = opinion.find(['div'], attrs={"class": 'review-content-header__dates'})
+                if date_of_post:
+                    date_of_post = str(date_of_post)
+                    date_of_post = re.search('"publishedDate":"(.*)","updatedDate', date_of_post).group(1)
+                    info.append(date_of_post)
+                infos.append(info)
+            tag = soup.find(["a"], attrs={"class": "button button--primary next-page"})
+            if tag and num_page != max_page:
+                num_page += 1
+            else:
+                page_to_scrape = False
+    return pd.DataFrame(infos, columns=['site', 'note', 'titre', 'comment', 'date'])
+
+
+@pytest.fixture
+def base_url(monkeypatch, cache_dir):
+    # recorded pages served locally, caches in a temporary folder
+    server = stub_server.start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    monkeypatch.setattr(fetch, 'BASE_URL', url)
+    monkeypatch.setattr(scraping, 'names_cache', cache.Cache('site_names'))
+    yield url
+    server.shutdown()
+
+
+@pytest.fixture
+def site_fetcher():
+    return fetch.Fetcher(headers=scraping.HEADERS, rate=0, host_rate=0, cache_mode='off')
+
+
+@pytest.mark.parametrize('backend', ['lxml', 'html.parser'])
+@pytest.mark.parametrize('max_page', [1, 2, 0])
+def test_scrape_site_matches_html_parser(base_url, site_fetcher, monkeypatch, backend, max_page):
+    monkeypatch.setattr(parsers, 'parse_review_page', partial(parsers.parse_review_page, backend=backend))
+    refs = ['lepetitbistrot.fr', 'pizzeria-napoli.fr', 'www.chezmarcel.com', 'brasserie-du-port.com']
+
+    df = scraping.scrape_site(refs, max_page, site_fetcher=site_fetcher)
+
+    assert len(df) > 0
+    pd.testing.assert_frame_equal(df.drop(columns='published'), legacy_scrape_site(base_url, refs, max_page))
+    assert df['published'].notna().all()
+
+
+@pytest.mark.parametrize('num_of_site', [0, 2, 3, 10])
+def test_scrape_category_matches_html_parser(base_url, site_fetcher, num_of_site):
+    refs = scraping.scrape_category('restaurants_bars', 'no city', num_of_site, site_fetcher=site_fetcher)
+    legacy_refs = legacy_scrape_category(base_url, 'restaurants_bars', num_of_site)
+
+    # sites to scrape are the same, category pages are no longer read once enough sites are found
+    assert refs[1] == legacy_refs[1]
+    assert refs[0] == legacy_refs[0][:len(refs[0])]
+    if num_of_site == 0:
+        assert refs[0] == legacy_refs[0]
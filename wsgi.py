@@ -0,0 +1,35 @@
+import os
+import gc
+import time
+
+start = time.perf_counter()
+
+# number of threads used by torch and by numpy matrix products in each worker, set before any model is loaded,
+# they replace OMP_NUM_THREADS and OPENBLAS_NUM_THREADS / MKL_NUM_THREADS of the environment when set
+TORCH_THREADS = os.environ.get('TORCH_THREADS')
+BLAS_THREADS = os.environ.get('BLAS_THREADS')
+# models loaded before the workers are forked
+PRELOAD_MODELS = [name for name in os.environ.get('PRELOAD_MODELS', 'spacy,word2vec,bigram,camembert').split(',')
+                  if name]
+
+# read by numpy, onnxruntime and torch when they are imported, 1 thread if neither the variable
+# nor TORCH_THREADS / BLAS_THREADS is set (torch threads are also set when camemBERT is loaded, see model.py)
+for variable, threads in [('OPENBLAS_NUM_THREADS', BLAS_THREADS), ('MKL_NUM_THREADS', BLAS_THREADS),
+                          ('OMP_NUM_THREADS', TORCH_THREADS)]:
+    if threads:
+        os.environ[variable] = threads
+    else:
+        os.environ.setdefault(variable, '1')
+
+# importation of linked python file, models and spaCy pipeline are loaded below
+import api
+import registry
+
+# load models in the master process, workers share their memory pages copy-on-write
+registry.preload(PRELOAD_MODELS)
+app = api.create_app()
+
+# objects loaded so far are never collected, so that the garbage collector does not write into shared pages
+gc.freeze()
+
+print(f'Application loaded in {time.perf_counter() - start:.2f}s ({registry.rss_mb():.0f} MB)')